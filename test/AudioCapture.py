@@ -0,0 +1,139 @@
+import asyncio
+import time
+import numpy as np
+import pyaudio
+import Utils
+
+
+class AudioCapture:
+    """Microphone capture running in PyAudio callback mode
+
+    PortAudio calls ``_callback`` from its own thread and the samples are
+    copied into a preallocated int16 ring buffer. The audio thread is the only
+    writer of ``_written`` and the asyncio consumer the only writer of
+    ``_read``, so no lock is shared between the two. ``read`` hands out the
+    frames back to back while the consumer is less than one frame behind.
+    Once it lags further ``read`` jumps to the newest complete frame and
+    counts the samples it skips in ``skipped_samples`` and the whole frames
+    in ``dropped_frames``.
+
+    The ring holds at least one second of audio, so ``resize`` can change
+    the frame size while the stream keeps running. PortAudio delivers
+    ``chunk_size`` samples per callback (default: one frame).
+
+    ``frame_time`` is the estimated time.perf_counter() value at which the
+    newest sample of the frame returned by ``read`` was recorded.
+    """
+    def __init__(self, frame_size, rate=Utils.MIC_RATE, device_index=-1,
+                 ring_frames=8, chunk_size=None):
+        self.frame_size = frame_size
+        self.rate = rate
+        self.device_index = device_index
+        self.chunk_size = chunk_size or frame_size
+        self.capacity = max(frame_size * ring_frames, rate)
+        self.frame = np.zeros(frame_size, dtype=np.float32)
+        self.frame_time = None
+        self.input_latency = 0.0
+        self.frames = 0
+        self.dropped_frames = 0
+        self.skipped_samples = 0
+        self.overflows = 0
+        self.overruns = 0
+        self._ring = np.zeros(self.capacity, dtype=np.int16)
+        self._written = 0
+        self._read = 0
+        # (value of _written, time) of the newest callback
+        self._stamp = (0, 0.0)
+        self._stream = None
+        self._loop = None
+        self._ready = None
+
+    def start(self, audio=None):
+        """Opens the input stream on ``audio`` (default ``Utils.p``)"""
+        audio = Utils.p if audio is None else audio
+        self._loop = asyncio.get_event_loop()
+        self._ready = asyncio.Event()
+        self._stream = audio.open(format=pyaudio.paInt16,
+                                  channels=1,
+                                  input_device_index=self.device_index,
+                                  rate=self.rate,
+                                  input=True,
+                                  frames_per_buffer=self.chunk_size,
+                                  stream_callback=self._callback)
+        self.input_latency = self._stream.get_input_latency()
+        self._stream.start_stream()
+
+    def stop(self):
+        """Stops and closes the input stream"""
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+
+    def resize(self, frame_size):
+        """Changes the size of the frames read() returns, without reopening
+        the stream or losing buffered samples"""
+        if frame_size * 2 > self.capacity:
+            raise ValueError('Frame size must be <= {}'.format(self.capacity // 2))
+        self.frame_size = frame_size
+        self.frame = np.zeros(frame_size, dtype=np.float32)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        data = np.frombuffer(in_data, dtype=np.int16)[-self.capacity:]
+        start = self._written % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._ring[start:start + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+        self._written += len(data)
+        self._stamp = (self._written, time.perf_counter())
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        self._loop.call_soon_threadsafe(self._ready.set)
+        return (None, pyaudio.paContinue)
+
+    async def read(self):
+        """Waits for and returns the next complete frame as float32
+
+        The returned array is reused for the next frame.
+        """
+        while self._written - self._read < self.frame_size:
+            self._ready.clear()
+            if self._written - self._read < self.frame_size:
+                await self._ready.wait()
+        while True:
+            written = self._written
+            if written - self._read < 2 * self.frame_size:
+                # Keeping up: the frame follows the previous one
+                end = self._read + self.frame_size
+            else:
+                # Lagging: skip to the newest frame
+                end = written
+            start = (end - self.frame_size) % self.capacity
+            first = min(self.frame_size, self.capacity - start)
+            self.frame[:first] = self._ring[start:start + first]
+            self.frame[first:] = self._ring[:self.frame_size - first]
+            # The audio thread may have lapped the ring while copying
+            if self._written - end <= self.capacity - self.frame_size:
+                break
+            self.overruns += 1
+        # A newer callback may have come in since written was read
+        stamp_written, stamp = self._stamp
+        self.frame_time = (stamp - (stamp_written - end) / self.rate
+                           - self.input_latency)
+        skipped = end - self.frame_size - self._read
+        self.skipped_samples += skipped
+        self.dropped_frames += skipped // self.frame_size
+        self.frames += 1
+        self._read = end
+        return self.frame
+
+    def stats(self):
+        """Returns the capture counters as a dict"""
+        return {
+            'frames': self.frames,
+            'dropped_frames': self.dropped_frames,
+            'skipped_samples': self.skipped_samples,
+            'overflows': self.overflows,
+            'overruns': self.overruns,
+            'buffered_samples': self._written - self._read,
+        }
@@ -1,109 +1,266 @@
 import Utils
 import asyncio
+import time
 from dataclasses import dataclass
 from functools import cached_property
 from bleak import BleakScanner, BleakClient
 from bleak.backends.device import BLEDevice
-from PyQt5.QtCore import QObject, pyqtSignal
+from HLProtocol import HLCodec
+import DeviceCache
 
 UART_SERVICE_UUID = ""
-UART_RX_CHAR_UUID = ""
-UART_TX_CHAR_UUID = ""
 UART_SAFE_SIZE = 20
+DEVICE_PREFIX = "QHM"
+
+
+def known_devices(prefix=DEVICE_PREFIX):
+    """Returns {address: name} of the controllers seen in earlier scans"""
+    return {address: entry["name"] for address, entry in DeviceCache.items()
+            if str(entry.get("name")).startswith(prefix)}
+
+
+async def scan_devices(prefix=DEVICE_PREFIX, expected=(), timeout=8.0):
+    """Yields controllers whose name starts with prefix as soon as they are seen
+
+    Stops after timeout seconds, or as soon as every address in expected
+    has been seen. Found devices are remembered in DeviceCache.
+    """
+    found = asyncio.Queue()
+    seen = set()
+    missing = {address.upper() for address in expected}
+
+    def detected(device, advertisement_data):
+        name = device.name or advertisement_data.local_name
+        if device.address not in seen and str(name).startswith(prefix):
+            seen.add(device.address)
+            found.put_nowait(device)
+
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    async with BleakScanner(detection_callback=detected):
+        while loop.time() < deadline:
+            try:
+                device = await asyncio.wait_for(found.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            DeviceCache.update(device.address, name=device.name, last_seen=time.time())
+            yield device
+            if missing:
+                missing.discard(device.address.upper())
+                if not missing:
+                    break
+
+
+async def find_device(address, timeout=5.0):
+    """Resolves an address to a BLEDevice, returning as soon as it advertises"""
+    device = await BleakScanner.find_device_by_address(address, timeout=timeout)
+    if device is not None:
+        DeviceCache.update(device.address, name=device.name, last_seen=time.time())
+    return device
+
 
 @dataclass
-class QBleakClient(QObject):
+class QBleakClient:
+    """Connection to one controller, without Qt so pyhld.py never loads it.
+    The GUI uses the QObject subclass pyhl.QtBleakClient."""
     device : BLEDevice
 
-    messageChanged = pyqtSignal(bytes)
+    # The controller shows one color on the whole strip
+    sink_shape = Utils.SINK_COLOR
 
     def __post_init__(self):
-        global UART_SERVICE_UUID, UART_RX_CHAR_UUID, UART_TX_CHAR_UUID, UART_SAFE_SIZE
         super().__init__()
+        self.codec = HLCodec()
+        # Characteristic map of this device, restored from DeviceCache when
+        # it was discovered before
+        self.rx_char = None
+        self.tx_char = None
+        self._services = None
+        cached = DeviceCache.get(self.device.address)
+        if cached.get("tx_char"):
+            self.rx_char = cached.get("rx_char")
+            self.tx_char = cached["tx_char"]
+            self._services = cached.get("services")
+        # Link supervision: last written state per command and reconnect stats
+        self.reconnect_delay = 0.5
+        self.max_reconnect_delay = 30.0
+        self.reconnects = 0
+        self.reconnect_times = []
+        self.dropped_writes = 0
+        self._last_state = {}
+        self._closing = False
+        self._reconnect_task = None
+        # Services the BleakClient was created to resolve, and whether the
+        # characteristic map was dropped on the current connection
+        self._client_services = None
+        self._invalidated = False
 
     @cached_property
     def client(self) -> BleakClient:
-        return BleakClient(self.device, disconnected_callback=self._handle_disconnect)
+        # With a cached map only the services holding our characteristics
+        # need to be resolved on connect
+        self._client_services = self._services
+        return BleakClient(self.device, disconnected_callback=self._handle_disconnect,
+                           services=self._services)
 
     async def start(self):
-        global UART_TX_CHAR_UUID, UART_RX_CHAR_UUID
+        self._closing = False
         try:
             await self.client.connect()
-            for service in self.client.services:
-                if service.description == "Generic Access Profile":
-                    for char in service.characteristics:
-                        Utils.printLog("Set UART_RX_CHAR_UUID with {}".format(char.uuid))
-                        UART_RX_CHAR_UUID = char.uuid
-
-                elif service.description == "Vendor specific":
-                    for char in service.characteristics:
-                        if (','.join(char.properties) == "write-without-response,write") and UART_TX_CHAR_UUID == "":
-                            Utils.printLog("Set UART_TX_CHAR_UUID with {}".format(char.uuid))
-                            UART_TX_CHAR_UUID = char.uuid
-                            
+            self._invalidated = False
+            if self.tx_char is None:
+                self._discover()
+            else:
+                Utils.printLog("Using cached characteristics of {}", self.device.address)
+            return self.tx_char is not None
         except asyncio.CancelledError as ex:
             print(ex)
+            return False
+
+    def _discover(self):
+        """Walks the services of the connected device for the UART characteristics"""
+        self.rx_char = None
+        self.tx_char = None
+        services = []
+        for service in self.client.services:
+            if service.description == "Generic Access Profile":
+                for char in service.characteristics:
+                    Utils.printLog("Set UART_RX_CHAR_UUID with {}", char.uuid)
+                    self.rx_char = char.uuid
+                    services.append(service.uuid)
+
+            elif service.description == "Vendor specific":
+                for char in service.characteristics:
+                    if (','.join(char.properties) == "write-without-response,write") and self.tx_char is None:
+                        Utils.printLog("Set UART_TX_CHAR_UUID with {}", char.uuid)
+                        self.tx_char = char.uuid
+                        services.append(service.uuid)
+
+        if self.tx_char is not None:
+            DeviceCache.update(self.device.address, rx_char=self.rx_char,
+                               tx_char=self.tx_char, services=sorted(set(services)))
+
+    def _invalidate_chars(self):
+        """Drops the characteristic map after a failed write, once per connection
+
+        The map is looked up again on the current connection. If the client
+        only resolved the cached services and the characteristics are not
+        among them, it is replaced by one resolving every service and the
+        link is reconnected.
+        """
+        if self._invalidated:
+            return
+        self._invalidated = True
+        DeviceCache.forget(self.device.address, "rx_char", "tx_char", "services")
+        self._services = None
+        self.rx_char = None
+        self.tx_char = None
+        if self.client.is_connected:
+            self._discover()
+        if self.tx_char is None and self._client_services is not None:
+            stale = self.__dict__.pop("client")
+            self._client_services = None
+            if not self._closing and self._reconnect_task is None:
+                self._reconnect_task = asyncio.ensure_future(self._reconnect(stale))
+
+    async def _write(self, values):
+        # Output is dropped while the link is down, see _reconnect
+        if not self.client.is_connected or self.tx_char is None:
+            self.dropped_writes += 1
+            return
+        try:
+            await self.client.write_gatt_char(self.tx_char, values, False)
+        except Exception as inst:
+            print(inst)
+            self._invalidate_chars()
+
+    def _remember(self, command, *args):
+        # Latest command last, so a replay ends with what was set most recently
+        self._last_state.pop(command, None)
+        self._last_state[command] = args
 
     async def stop(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
         try:
             await self.client.disconnect()
         except asyncio.CancelledError as ex:
             pass
 
     async def writeColor(self, R=0, G=0, B=0):
-            lista = [86, R, G, B, (int(10 * 255 / 100) & 0xFF), 256-16, 256-86]
-            values = bytearray(lista)
-            try:
-                Utils.printLog("Change Color called R:{} G:{} B:{} ".format(R, G, B))
-                await self.client.write_gatt_char(UART_TX_CHAR_UUID, values, False)
-            except Exception as inst:
-                print(inst)
+            values = self.codec.color(R, G, B)
+            Utils.printLog("Change Color called R:{} G:{} B:{} ", R, G, B)
+            self._remember("writeColor", R, G, B)
+            await self._write(values)
 
     async def writePower(self, state):
-            lista = [204, 35, 51]
-            if state == "Off":
-                lista = [204, 36, 51]
-
-            values = bytearray(lista)
-            try:
-                Utils.printLog("Change Power called Power : {}".format(state))
-                await self.client.write_gatt_char(UART_TX_CHAR_UUID, values, False)
-            except Exception as inst:
-                print(inst)
+            values = self.codec.power(state)
+            Utils.printLog("Change Power called Power : {}", state)
+            self._remember("writePower", state)
+            await self._write(values)
 
     async def writeMode(self, idx):
-
-            #new byte[] { 256 - 69, mode, (byte)(speed & 0xFF), 68 };
             i_mode = Utils.Modes[idx]
-            lista = [256 - 69, i_mode, (Utils.Speed & 0xFF), 68]
-            values = bytearray(lista)
-            try:
-                Utils.printLog("Change Mode with ID {} Speed {}".format(i_mode, Utils.Speed))
-                await self.client.write_gatt_char(UART_TX_CHAR_UUID, values, False)
-            except Exception as inst:
-                print(inst)
+            values = self.codec.mode(i_mode, Utils.Speed)
+            Utils.printLog("Change Mode with ID {} Speed {}", i_mode, Utils.Speed)
+            self._remember("writeMode", idx)
+            await self._write(values)
 
     async def writeMicState(self, enable):
-            
-            var_1 = -1
-            var_2 = -1
-            if enable:
-                var_1 = 256 - 16
-                var_2 = 50
-            else:
-                var_1 = 15
-                var_2 = 30
-            lista = [1, var_1, var_2,0 ,0, 24]
-            values = bytearray(lista)
-            try:
-                #Utils.printLog("Change Mode with ID {} ".format(i_mode))
-                await self.client.write_gatt_char(UART_TX_CHAR_UUID, values, False)
-            except Exception as inst:
-                print(inst)
+            values = self.codec.mic(enable)
+            Utils.printLog("Change Mic State enable : {}", enable)
+            self._remember("writeMicState", enable)
+            await self._write(values)
 
-    #TODO: Implement disconnect function
     def _handle_disconnect(self, device) -> None:
         Utils.printLog("Device was disconnected")
-        # cancelling all tasks effectively ends the program
-        for task in asyncio.all_tasks():
-            task.cancel()
+        if self._closing or self._reconnect_task is not None:
+            return
+        print(f"Lost connection to {self.device.address}, reconnecting")
+        self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self, stale=None):
+        """Reconnects with exponential backoff and replays the last state
+
+        The rest of the program keeps running meanwhile, writes are just
+        dropped until the link is back. ``stale`` is a replaced BleakClient
+        that is still connected.
+        """
+        start = time.perf_counter()
+        delay = self.reconnect_delay
+        try:
+            if stale is not None:
+                try:
+                    await stale.disconnect()
+                except Exception as e:
+                    Utils.printLog("Disconnecting {} failed: {}", self.device.address, e)
+            while not self._closing:
+                await asyncio.sleep(delay)
+                try:
+                    if await self.start():
+                        break
+                except Exception as e:
+                    Utils.printLog("Reconnect to {} failed: {}", self.device.address, e)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            else:
+                return
+            elapsed = time.perf_counter() - start
+            self.reconnects += 1
+            self.reconnect_times.append(elapsed)
+            print(f"Reconnected to {self.device.address} in {elapsed:.1f} s")
+            for command, args in list(self._last_state.items()):
+                await getattr(self, command)(*args)
+        finally:
+            self._reconnect_task = None
+
+    def metrics(self):
+        """Returns the link supervision counters as a dict"""
+        return {
+            "connected": self.client.is_connected,
+            "reconnecting": self._reconnect_task is not None,
+            "reconnects": self.reconnects,
+            "last_reconnect_time": self.reconnect_times[-1] if self.reconnect_times else None,
+            "dropped_writes": self.dropped_writes,
+        }
@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import deque
+import Utils
+
+
+class AdaptiveSender:
+    """Sends colors to the LED controller at the rate its BLE link sustains
+
+    The audio loop only hands over colors with ``submit_color``, which never
+    waits. A separate task writes the newest pending color, measures how
+    long ``writeColor`` took and spaces the following writes accordingly.
+    A color that is replaced before it could be written is dropped.
+
+    Other commands (power, mode, ...) go through a bounded queue with
+    ``submit_command`` and are written before the pending color. When the
+    queue is full the oldest command is dropped.
+
+    ``submit_pulse`` is for colors that have to show right away (beat
+    pulses): it is written ahead of everything else and cuts the pacing
+    delay after the previous write short.
+    """
+    def __init__(self, client=None, max_rate=None, min_rate=5.0,
+                 headroom=1.2, smoothing=0.2, queue_size=8):
+        """client defaults to whatever Utils.client is at send time, max_rate
+        to whatever Utils.FPS is"""
+        self.client = client
+        self.max_rate = max_rate
+        self.max_interval = 1.0 / min_rate
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.interval = self.min_interval
+        self.latency = None
+        self.sent = 0
+        self.dropped = 0
+        self.dropped_commands = 0
+        self.pulses = 0
+        self.errors = 0
+        self._commands = deque(maxlen=queue_size)
+        self._pending = None
+        self._pulse = None
+        self._wake = asyncio.Event()
+        self._pulse_ready = asyncio.Event()
+        self._task = None
+
+    @property
+    def min_interval(self):
+        return 1.0 / (self.max_rate or Utils.FPS)
+
+    def submit_color(self, red, green, blue):
+        """Queues a color, replacing the one still waiting to be sent"""
+        if self._pending is not None:
+            self.dropped += 1
+        self._pending = (red, green, blue)
+        self._wake.set()
+
+    def submit_pulse(self, red, green, blue, on_sent=None):
+        """Queues a color to be written before anything else, without waiting
+        for the pacing interval. It replaces the pending color.
+
+        ``on_sent(time)`` is called with the time.perf_counter() value at
+        which the write finished.
+        """
+        if self._pending is not None:
+            self.dropped += 1
+            self._pending = None
+        self._pulse = ((red, green, blue), on_sent)
+        self._wake.set()
+        self._pulse_ready.set()
+
+    def submit_command(self, name, *args):
+        """Queues a call of a QBleakClient write method, e.g. ("writePower", "On")"""
+        if len(self._commands) == self._commands.maxlen:
+            self.dropped_commands += 1
+        self._commands.append((name, args))
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        clock = time.perf_counter
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            client = self.client if self.client is not None else Utils.client
+            if client is None:
+                self._commands.clear()
+                self._pending = None
+                self._pulse = None
+                continue
+            if self._pulse is not None:
+                await self._send_pulse(client)
+            while self._commands:
+                name, args = self._commands.popleft()
+                await self._call(getattr(client, name), *args)
+            color, self._pending = self._pending, None
+            if color is None:
+                continue
+            start = clock()
+            if not await self._call(client.writeColor, *color):
+                continue
+            elapsed = clock() - start
+            self.sent += 1
+            self._update_rate(elapsed)
+            await self._pace(self.interval - elapsed)
+
+    async def _call(self, write, *args):
+        """Awaits one write, a failing write is counted and logged but never
+        ends the sender"""
+        try:
+            await write(*args)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            print("{} failed: {}".format(getattr(write, '__name__', write), e))
+            return False
+
+    async def _pace(self, delay):
+        """Waits delay seconds, or less if a pulse comes in"""
+        self._pulse_ready.clear()
+        if delay <= 0.0 or self._pulse is not None:
+            return
+        try:
+            await asyncio.wait_for(self._pulse_ready.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _send_pulse(self, client):
+        color, on_sent = self._pulse
+        self._pulse = None
+        if hasattr(client, 'writePulse'):
+            # A DeviceGroup hands the pulse to the sender of every device and
+            # returns at once, those report when their device wrote it
+            if await self._call(client.writePulse, *color, on_sent):
+                self.pulses += 1
+            return
+        start = time.perf_counter()
+        if not await self._call(client.writeColor, *color):
+            return
+        done = time.perf_counter()
+        self.sent += 1
+        self.pulses += 1
+        self._update_rate(done - start)
+        if on_sent is not None:
+            on_sent(done)
+
+    def _update_rate(self, elapsed):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.smoothing * (elapsed - self.latency)
+        self.interval = min(max(self.latency * self.headroom, self.min_interval),
+                            self.max_interval)
+
+    def stats(self):
+        """Returns the sender counters as a dict"""
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'queued_commands': len(self._commands),
+            'dropped_commands': self.dropped_commands,
+            'pulses': self.pulses,
+            'errors': self.errors,
+            'latency_ms': None if self.latency is None else self.latency * 1e3,
+            'rate': 1.0 / self.interval,
+        }
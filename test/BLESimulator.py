@@ -0,0 +1,146 @@
+"""In-process stand-in for a HappyLighting controller and its BLE link.
+
+SimulatedClient replaces the bleak BleakClient behind a QBleakClient:
+
+    client = BLEClass.QBleakClient(SimDevice())
+    SimulatedClient(connection_interval=0.03).attach(client)
+    await client.start()
+
+Writes are delivered at the pace of the modeled link (a number of packets
+per connection interval) and every decoded command is recorded with the
+time it reached the device.
+
+A QBleakClient stores the GATT map it discovers in DeviceCache, run
+simulations inside ``private_device_cache()`` so the simulated devices do
+not end up in the cache of the user:
+
+    with private_device_cache():
+        asyncio.run(simulation())
+"""
+import asyncio
+import os
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import DeviceCache
+import HLProtocol
+
+SimDevice = namedtuple('SimDevice', ['address', 'name'],
+                       defaults=('00:00:00:00:00:00', 'QHM-SIM'))
+
+SimService = namedtuple('SimService', ['uuid', 'description', 'characteristics'])
+SimCharacteristic = namedtuple('SimCharacteristic', ['uuid', 'properties'])
+
+Received = namedtuple('Received', ['time', 'command'])
+"""A command as it reached the device, time is a time.perf_counter value"""
+
+DEVICE_NAME_UUID = '00002a00-0000-1000-8000-00805f9b34fb'
+TX_CHAR_UUID = '0000ffd9-0000-1000-8000-00805f9b34fb'
+NOTIFY_CHAR_UUID = '0000ffd4-0000-1000-8000-00805f9b34fb'
+
+
+@contextmanager
+def private_device_cache():
+    """Points DeviceCache at a throwaway file for the duration of the block"""
+    with tempfile.TemporaryDirectory() as directory:
+        previous = DeviceCache.use_path(os.path.join(directory, 'devices.json'))
+        try:
+            yield
+        finally:
+            DeviceCache.use_path(previous)
+
+
+class SimulatedClient:
+    """Fake BleakClient modeling the throughput of a BLE connection
+
+    Parameters
+    ----------
+    connection_interval : float
+        Seconds between two connection events of the link
+
+    packets_per_interval : int
+        Packets the link carries per connection event, further writes wait
+        for the next event
+
+    connect_delay : float
+        Seconds ``connect`` takes
+    """
+    def __init__(self, device=None, connection_interval=0.0075,
+                 packets_per_interval=4, connect_delay=0.0,
+                 disconnected_callback=None):
+        self.device = device or SimDevice()
+        self.address = self.device.address
+        self.connection_interval = connection_interval
+        self.packets_per_interval = packets_per_interval
+        self.connect_delay = connect_delay
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.received = []
+        self.services = [
+            SimService('00001800-0000-1000-8000-00805f9b34fb',
+                       'Generic Access Profile',
+                       [SimCharacteristic(DEVICE_NAME_UUID, ['read'])]),
+            SimService('0000ffd5-0000-1000-8000-00805f9b34fb',
+                       'Vendor specific',
+                       [SimCharacteristic(TX_CHAR_UUID,
+                                          ['write-without-response', 'write'])]),
+            SimService('0000ffd0-0000-1000-8000-00805f9b34fb',
+                       'Vendor specific',
+                       [SimCharacteristic(NOTIFY_CHAR_UUID, ['notify'])]),
+        ]
+        self._epoch = 0.0
+        self._event = 0
+        self._event_packets = 0
+
+    def attach(self, qclient):
+        """Installs the simulator as the bleak client of a QBleakClient"""
+        qclient.client = self
+        self.disconnected_callback = qclient._handle_disconnect
+        return self
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.connect_delay)
+        self.is_connected = True
+        self._epoch = time.perf_counter()
+        self._event = 0
+        self._event_packets = 0
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+        return True
+
+    def drop_link(self):
+        """Simulates the device going out of range"""
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def write_gatt_char(self, char_specifier, data, response=False):
+        if not self.is_connected:
+            raise ConnectionError('Not connected')
+        uuid = getattr(char_specifier, 'uuid', char_specifier)
+        if uuid != TX_CHAR_UUID:
+            raise ValueError('Characteristic {} was not found'.format(uuid))
+        packet = bytes(data)
+        await asyncio.sleep(max(0.0, self._reserve_slot(response) - time.perf_counter()))
+        if not self.is_connected:
+            raise ConnectionError('Disconnected')
+        self.received.append(Received(time.perf_counter(), HLProtocol.decode(packet)))
+
+    def _reserve_slot(self, response):
+        """Returns the time of the connection event that carries the write"""
+        event = int((time.perf_counter() - self._epoch) / self.connection_interval) + 1
+        if event > self._event:
+            self._event, self._event_packets = event, 0
+        elif self._event_packets >= self.packets_per_interval:
+            self._event, self._event_packets = self._event + 1, 0
+        self._event_packets += 1
+        # A write with response is acknowledged one event later
+        event = self._event + (1 if response else 0)
+        return self._epoch + event * self.connection_interval
+
+    def commands(self, kind=None):
+        """Returns the received commands, optionally only those of one kind"""
+        return [r for r in self.received if kind is None or r.command.kind == kind]
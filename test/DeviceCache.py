@@ -0,0 +1,67 @@
+"""Persistent per-device data (GATT characteristics, names), keyed by BLE
+address and stored as JSON at Utils.DEVICE_CACHE_PATH."""
+import json
+import os
+import Utils
+
+_cache = None
+
+
+def _load():
+    global _cache
+    if _cache is None:
+        try:
+            with open(Utils.DEVICE_CACHE_PATH) as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save():
+    try:
+        os.makedirs(os.path.dirname(Utils.DEVICE_CACHE_PATH), exist_ok=True)
+        tmp = Utils.DEVICE_CACHE_PATH + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(_cache, f, indent=1)
+        os.replace(tmp, Utils.DEVICE_CACHE_PATH)
+    except OSError as e:
+        print("Could not save device cache: {}".format(e))
+
+
+def use_path(path):
+    """Switches the cache to another file, returns the previous path"""
+    global _cache
+    previous = Utils.DEVICE_CACHE_PATH
+    Utils.DEVICE_CACHE_PATH = path
+    _cache = None
+    return previous
+
+
+def get(address):
+    """Returns the cached entry of a device as a dict ({} if unknown)"""
+    return dict(_load().get(address.upper(), {}))
+
+
+def items():
+    """Returns (address, entry) pairs of every cached device"""
+    return [(address, dict(entry)) for address, entry in _load().items()]
+
+
+def update(address, **fields):
+    """Stores fields in the entry of a device"""
+    _load().setdefault(address.upper(), {}).update(fields)
+    _save()
+
+
+def forget(address, *fields):
+    """Removes fields (default: the whole entry) of a device"""
+    cache = _load()
+    address = address.upper()
+    if address not in cache:
+        return
+    if not fields:
+        del cache[address]
+    elif not any([cache[address].pop(field, None) is not None for field in fields]):
+        return
+    _save()
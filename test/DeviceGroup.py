@@ -0,0 +1,100 @@
+import asyncio
+import Utils
+import BLEClass
+from BLESender import AdaptiveSender
+
+
+class DeviceGroup:
+    """Several LED controllers connected at once and driven as one
+
+    Has the same write methods as QBleakClient, so a group can be used
+    wherever ``Utils.client`` is. Each device gets its own AdaptiveSender
+    with a bounded command queue, so the writes to every device run
+    concurrently and a slow strip never holds back the others.
+    """
+    sink_shape = Utils.SINK_COLOR
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.members = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, address):
+        return address in self.members
+
+    @property
+    def clients(self):
+        return [client for client, _ in self.members.values()]
+
+    async def add(self, device, client=None):
+        """Connects to a device and adds it to the group
+
+        ``client`` can be an existing (not yet started) QBleakClient for the
+        device. Returns whether the connection succeeded, a device that
+        cannot be reached never keeps the others from joining.
+        """
+        if device.address in self.members:
+            return True
+        client = client or BLEClass.QBleakClient(device)
+        try:
+            started = await client.start()
+        except Exception as e:
+            print("Could not connect to {}: {}".format(device.address, e))
+            started = False
+        if not started:
+            try:
+                await client.stop()
+            except Exception as e:
+                Utils.printLog("Closing {} failed: {}", device.address, e)
+            return False
+        sender = AdaptiveSender(client, queue_size=self.queue_size)
+        sender.start()
+        self.members[device.address] = (client, sender)
+        return True
+
+    async def connect(self, devices):
+        """Connects to many devices concurrently, returns the success of each"""
+        return await asyncio.gather(*(self.add(device) for device in devices))
+
+    async def remove(self, address):
+        """Disconnects one device and removes it from the group"""
+        client, sender = self.members.pop(address)
+        await sender.stop()
+        await client.stop()
+
+    async def stop(self):
+        """Disconnects every device of the group"""
+        await asyncio.gather(*(self.remove(address) for address in list(self.members)))
+
+    async def writeColor(self, R=0, G=0, B=0):
+        for _, sender in self.members.values():
+            sender.submit_color(R, G, B)
+
+    async def writePulse(self, R=0, G=0, B=0, on_sent=None):
+        """Sends a color ahead of everything queued, see AdaptiveSender.submit_pulse
+
+        Returns right away. ``on_sent(time)`` is called by the sender of
+        each device once that device wrote the pulse.
+        """
+        for _, sender in self.members.values():
+            sender.submit_pulse(R, G, B, on_sent=on_sent)
+
+    async def writePower(self, state):
+        Utils.printLog("Group Power : {} on {} devices", state, len(self))
+        for _, sender in self.members.values():
+            sender.submit_command("writePower", state)
+
+    async def writeMode(self, idx):
+        for _, sender in self.members.values():
+            sender.submit_command("writeMode", idx)
+
+    async def writeMicState(self, enable):
+        for _, sender in self.members.values():
+            sender.submit_command("writeMicState", enable)
+
+    def stats(self):
+        """Returns the sender counters of every device, keyed by address"""
+        return {address: sender.stats()
+                for address, (_, sender) in self.members.items()}
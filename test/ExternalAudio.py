@@ -1,50 +1,244 @@
 from __future__ import print_function
 from __future__ import division
 import time
-import qasync
-import pyaudio
+import math
 import numpy as np
-from scipy.ndimage.filters import gaussian_filter1d
 import Utils
 import dsp
+import StartupProfile
+from AudioCapture import AudioCapture
+from BLESender import AdaptiveSender
 #import led
 
 # Number of audio samples to read every time frame
-samples_per_frame = int(Utils.MIC_RATE / Utils.FPS)
-
-# Array containing the rolling audio sample window
-y_roll = np.random.rand(Utils.N_ROLLING_HISTORY, samples_per_frame) / 1e16
-
-fft_plot_filter = dsp.ExpFilter(np.tile(1e-1, Utils.N_FFT_BINS),
-                         alpha_decay=0.5, alpha_rise=0.99)
-mel_gain = dsp.ExpFilter(np.tile(1e-1, Utils.N_FFT_BINS),
-                         alpha_decay=0.01, alpha_rise=0.99)
-mel_smoothing = dsp.ExpFilter(np.tile(1e-1, Utils.N_FFT_BINS),
-                         alpha_decay=0.5, alpha_rise=0.99)
-volume = dsp.ExpFilter(Utils.MIN_VOLUME_THRESHOLD,
-                       alpha_decay=0.02, alpha_rise=0.02)
-fft_window = np.hamming(int(Utils.MIC_RATE / Utils.FPS) * Utils.N_ROLLING_HISTORY)
+samples_per_frame = None
+
+# Rolling audio sample window and FFT work buffers
+engine = None
+mel_output = None
+
 prev_fps_update = time.time()
 
-r_filt = dsp.ExpFilter(np.tile(0.01, Utils.N_PIXELS // 2),
-                       alpha_decay=0.2, alpha_rise=0.99)
-g_filt = dsp.ExpFilter(np.tile(0.01, Utils.N_PIXELS // 2),
-                       alpha_decay=0.05, alpha_rise=0.3)
-b_filt = dsp.ExpFilter(np.tile(0.01, Utils.N_PIXELS // 2),
-                       alpha_decay=0.1, alpha_rise=0.5)
-common_mode = dsp.ExpFilter(np.tile(0.01, Utils.N_PIXELS // 2),
-                       alpha_decay=0.99, alpha_rise=0.01)
-p_filt = dsp.ExpFilter(np.tile(1, (3, Utils.N_PIXELS // 2)),
-                       alpha_decay=0.1, alpha_rise=0.99)
-p = np.tile(1.0, (3, Utils.N_PIXELS // 2))
-gain = dsp.ExpFilter(np.tile(0.01, Utils.N_FFT_BINS),
-                     alpha_decay=0.001, alpha_rise=0.99)
+# Capture backend of the running stream, see AudioCapture.stats()
+capture = None
+
+CAPTURE_CHUNK = 256
+"""Samples per PortAudio callback, well below a frame so that frames keep
+coming on time when FPS is raised while running"""
+
+# Smoothing filters of the pipeline, see reset()
+filters = None
+_gamma = None
+_gamma8 = None
+
+# (3, N_PIXELS) float32 output of the effects, and the state of each effect
+pixels = None
+p = None
+_prev_spectrum = None
+_spectrum_diff = None
+_scroll = None
+_energy_blur = None
+_scroll_blur = None
+_beat_level = 0.0
+
+# Gamma corrected (N_PIXELS, 3) uint8 output for strip sinks, see led_pixels()
+_strip = None
+_strip_clipped = None
+_strip_index = None
+
+BEAT_DECAY = 0.85
+"""Brightness kept per frame by the beat effect after an onset"""
+
+# Gaussian smoothing of the mel energies for the gain normalization
+gain_smoother = None
+
+# Beat detection on the gain normalized mel energies, see dsp.OnsetDetector
+onsets = None
+
+PULSE_COLOR = (255, 255, 255)
+"""Color flashed on every onset when Utils.OnsetPulse is on"""
+
+PULSE_HOLD = 0.05
+"""Seconds the pulse stays on before the visualization takes over again"""
+_pulse_frames = 0
+
+
+def reset():
+    """(Re)builds the audio buffers and filter state from the Utils settings
+
+    Runs on first use of the pipeline. Use ``config.update`` to change the
+    settings of a running pipeline.
+    """
+    with StartupProfile.step('ExternalAudio.reset()'):
+        _rebuild(PARTS)
+
+
+def _filter_specs():
+    """(name, shape, initial value, alpha_decay, alpha_rise) of every filter
+
+    Filters that are updated together in the frame loop are next to each other.
+    """
+    bins = (Utils.N_FFT_BINS,)
+    half = (Utils.N_PIXELS // 2,)
+    return (
+        ('mel_gain', bins, 1e-1, 0.01, 0.99),
+        ('mel_smoothing', bins, 1e-1, 0.5, 0.99),
+        ('common_mode', half, 0.01, 0.99, 0.01),
+        ('r_filt', half, 0.01, 0.2, 0.99),
+        ('b_filt', half, 0.01, 0.1, 0.5),
+        ('g_filt', half, 0.01, 0.05, 0.3),
+        ('p_filt', (3,) + half, 1.0, 0.1, 0.99),
+        ('gain', bins, 0.01, 0.001, 0.99),
+        ('fft_plot_filter', bins, 1e-1, 0.5, 0.99),
+        ('volume', (), Utils.MIN_VOLUME_THRESHOLD, 0.02, 0.02),
+    )
+
+
+def _build_filters(previous=None):
+    """Builds the filter bank, keeping the state of previous filters whose
+    shape did not change"""
+    bank = dsp.ExpFilterBank()
+    for name, shape, initial, alpha_decay, alpha_rise in _filter_specs():
+        if previous is not None and previous[name].shape == shape:
+            value = previous[name]
+        else:
+            value = np.full(shape, initial)
+        bank.add(name, value, alpha_decay=alpha_decay, alpha_rise=alpha_rise)
+    return bank
+
+
+PARTS = ('frames', 'mel_bank', 'filters', 'pixels')
+"""Pieces of pipeline state, rebuilt separately when the settings change"""
+
+
+def _rebuild(parts, keep_state=False):
+    """Rebuilds the given PARTS of the pipeline from the Utils settings
+
+    With ``keep_state`` the rolling audio window and the filters carry over
+    into the rebuilt buffers as far as they still fit.
+    """
+    global samples_per_frame, engine, mel_output, filters, p, _prev_spectrum, pixels, _gamma
+    global gain_smoother, onsets, _spectrum_diff, _scroll, _energy_blur, _scroll_blur
+    global _gamma8, _strip, _strip_clipped, _strip_index
+    if _gamma is None:
+        _gamma = np.load(Utils.GAMMA_TABLE_PATH)
+        _gamma8 = _gamma.astype(np.uint8)
+    if 'frames' in parts:
+        previous = engine
+        frame_size = int(Utils.MIC_RATE / Utils.FPS)
+        # First, so a frame size the capture cannot take changes nothing
+        if capture is not None:
+            capture.resize(frame_size)
+        samples_per_frame = frame_size
+        engine = dsp.FrameEngine(samples_per_frame, Utils.N_ROLLING_HISTORY)
+        if keep_state and previous is not None:
+            engine.prime(previous.history())
+    if 'mel_bank' in parts:
+        dsp.create_mel_bank()
+        mel_output = np.zeros(Utils.N_FFT_BINS)
+        gain_smoother = dsp.GaussianSmoother(Utils.N_FFT_BINS, sigma=1.0)
+        # Threshold adapts over half a second, at most ten onsets per second
+        onsets = dsp.OnsetDetector(Utils.N_FFT_BINS, window=max(Utils.FPS // 2, 2),
+                                   refractory=max(Utils.FPS // 10, 1))
+    if 'filters' in parts:
+        filters = _build_filters(filters if keep_state else None)
+    if 'pixels' in parts:
+        half = Utils.N_PIXELS // 2
+        pixels = np.zeros((3, Utils.N_PIXELS), dtype=np.float32)
+        p = np.tile(1.0, (3, half))
+        _prev_spectrum = np.tile(0.01, half)
+        _spectrum_diff = np.zeros(half)
+        _scroll = np.zeros((3, half))
+        _energy_blur = dsp.GaussianSmoother((3, half), sigma=4.0)
+        _scroll_blur = dsp.GaussianSmoother((3, half), sigma=0.2)
+        _strip = np.zeros((Utils.N_PIXELS, 3), dtype=np.uint8)
+        _strip_clipped = np.zeros((3, Utils.N_PIXELS), dtype=np.float32)
+        _strip_index = np.zeros((3, Utils.N_PIXELS), dtype=np.intp)
+
+
+class PipelineConfig:
+    """The Utils settings of the audio pipeline, changeable while it runs
+
+    Reading ``config.FPS`` etc. returns the value in Utils. ``update``
+    validates and applies new values and rebuilds only the pipeline state
+    that depends on them: the audio window for FPS and N_ROLLING_HISTORY,
+    the mel bank for those and the frequency range, the filters for
+    N_FFT_BINS and N_PIXELS. The rolling audio window and every filter that
+    keeps its shape carry over, and a running capture keeps its stream, so
+    no audio is dropped. If a rebuild fails anyway the previous settings are
+    put back and rebuilt before the error is raised.
+    """
+    DEPENDENCIES = {
+        'N_PIXELS': ('filters', 'pixels'),
+        'FPS': ('frames', 'mel_bank'),
+        'N_ROLLING_HISTORY': ('frames', 'mel_bank'),
+        'N_FFT_BINS': ('mel_bank', 'filters'),
+        'MIN_FREQUENCY': ('mel_bank',),
+        'MAX_FREQUENCY': ('mel_bank',),
+    }
+
+    def __getattr__(self, name):
+        if name in self.DEPENDENCIES:
+            return getattr(Utils, name)
+        raise AttributeError(name)
+
+    def as_dict(self):
+        return {name: getattr(Utils, name) for name in self.DEPENDENCIES}
 
-_prev_spectrum = np.tile(0.01, Utils.N_PIXELS // 2)
+    def validate(self, settings):
+        """Raises ValueError if the settings (merged into the current ones) are invalid"""
+        unknown = set(settings) - set(self.DEPENDENCIES)
+        if unknown:
+            raise ValueError('Unknown pipeline settings {}'.format(', '.join(sorted(unknown))))
+        new = dict(self.as_dict(), **settings)
+        for name, value in new.items():
+            if int(value) != value or value <= 0:
+                raise ValueError('{} must be a positive integer'.format(name))
+        max_led_fps = int(((new['N_PIXELS'] * 30e-6) + 50e-6)**-1.0)
+        if new['FPS'] > max_led_fps:
+            raise ValueError('FPS must be <= {}'.format(max_led_fps))
+        if new['N_PIXELS'] < 2:
+            # The effects render one half of the strip and mirror it
+            raise ValueError('N_PIXELS must be >= 2')
+        if new['N_FFT_BINS'] < 3:
+            # The effects split the bands into low, middle and high thirds
+            raise ValueError('N_FFT_BINS must be >= 3')
+        if new['FPS'] * 2 > Utils.MIC_RATE:
+            raise ValueError('FPS must be <= {}'.format(Utils.MIC_RATE // 2))
+        if not new['MIN_FREQUENCY'] < new['MAX_FREQUENCY'] <= Utils.MIC_RATE / 2:
+            raise ValueError('Need MIN_FREQUENCY < MAX_FREQUENCY <= {}'.format(
+                Utils.MIC_RATE / 2))
+        if capture is not None and int(Utils.MIC_RATE / new['FPS']) * 2 > capture.capacity:
+            # The running stream keeps its ring buffer
+            raise ValueError('FPS must be >= {} while capturing'.format(
+                math.ceil(Utils.MIC_RATE / (capture.capacity // 2))))
 
-pixels = np.tile(1, (3, Utils.N_PIXELS))
+    def update(self, **settings):
+        """Applies new settings, returns the PARTS that were rebuilt"""
+        self.validate(settings)
+        changed = [name for name, value in settings.items()
+                   if getattr(Utils, name) != value]
+        previous = {name: getattr(Utils, name) for name in changed}
+        for name in changed:
+            setattr(Utils, name, settings[name])
+        parts = {part for name in changed for part in self.DEPENDENCIES[name]}
+        # Nothing to carry over before the pipeline first ran, it is built
+        # from the new settings on first use
+        if parts and engine is not None:
+            with StartupProfile.step('ExternalAudio rebuild {}'.format(sorted(parts))):
+                try:
+                    _rebuild(parts, keep_state=True)
+                except Exception:
+                    for name, value in previous.items():
+                        setattr(Utils, name, value)
+                    _rebuild(parts, keep_state=True)
+                    raise
+            Utils.printLog('Pipeline rebuilt {} for {}', sorted(parts), changed)
+            return parts
+        return set()
 
-_gamma = np.load(Utils.GAMMA_TABLE_PATH)
+
+config = PipelineConfig()
 
 def memoize(function):
     """Provides a decorator for memoizing functions"""
@@ -90,27 +284,179 @@ def interpolate(y, new_length):
     z = np.interp(x_new, x_old, y)
     return z
 
-def visualize_spectrum(y):
+def _right_half(out):
+    """Returns the view of the right half of the strip the effects render into
+
+    With an odd N_PIXELS the center pixel is in neither half.
+    """
+    return out[:, Utils.N_PIXELS - Utils.N_PIXELS // 2:]
+
+
+def _mirror(out):
+    """Mirrors the right half of the strip onto the left half, the center
+    pixel of an odd strip takes the innermost color of the halves"""
+    half = Utils.N_PIXELS // 2
+    np.copyto(out[:, :half], _right_half(out)[:, ::-1])
+    if Utils.N_PIXELS % 2:
+        np.copyto(out[:, half], out[:, half + 1])
+    return out
+
+
+def _band_levels(y):
+    """Returns the maxima of the low, middle and high third of the bands"""
+    third = len(y) // 3
+    return (float(np.max(y[:third])), float(np.max(y[third:2 * third])),
+            float(np.max(y[2 * third:])))
+
+
+def visualize_spectrum(y, out=None):
     """Effect that maps the Mel filterbank frequencies onto the LED strip"""
-    global _prev_spectrum
-    y = np.copy(interpolate(y, Utils.N_PIXELS // 2))
-    common_mode.update(y)
-    diff = y - _prev_spectrum
-    _prev_spectrum = np.copy(y)
+    if filters is None:
+        reset()
+    out = pixels if out is None else out
+    half = Utils.N_PIXELS // 2
+    y = interpolate(y, half)
+    common_mode = filters.update('common_mode', y)
+    diff = np.subtract(y, _prev_spectrum, out=_spectrum_diff)
+    np.copyto(_prev_spectrum, y)
     # Color channel mappings
-    r = r_filt.update(y - common_mode.value)
-    g = np.abs(diff)
-    b = b_filt.update(np.copy(y))
+    np.subtract(y, common_mode, out=filters.inputs['r_filt'])
+    np.copyto(filters.inputs['b_filt'], y)
+    filters.update_many(('r_filt', 'b_filt'))
+    right = _right_half(out)
+    np.multiply(filters['r_filt'], 255, out=right[0])
+    np.abs(diff, out=diff)
+    np.multiply(diff, 255, out=right[1])
+    np.multiply(filters['b_filt'], 255, out=right[2])
     # Mirror the color channels for symmetric output
-    #r = np.concatenate((r[::-1], r))
-    #g = np.concatenate((g[::-1], g))
-    #b = np.concatenate((b[::-1], b))
-    output = np.array([r, g,b]) * 255
-    return output
+    return _mirror(out)
 
 
-async def updateLedColor(red, green, blue):
+def visualize_energy(y, out=None):
+    """Effect that expands from the center with increasing sound energy"""
+    if filters is None:
+        reset()
+    out = pixels if out is None else out
+    half = Utils.N_PIXELS // 2
+    # The input buffer of the gain filter doubles as scratch space
+    scaled = filters.inputs['gain']
+    filters.update('gain', y)
+    np.divide(y, filters['gain'], out=scaled)
+    # Scale by the width of the LED strip
+    scaled *= float(half - 1)
+    # Map color channels according to energy in the different freq bands
+    np.power(scaled, 0.9, out=scaled)
+    third = len(y) // 3
+    for channel, band in enumerate((scaled[:third], scaled[third:2 * third],
+                                    scaled[2 * third:])):
+        length = int(np.mean(band))
+        p[channel, :length] = 255.0
+        p[channel, length:] = 0.0
+    np.round(filters.update('p_filt', p), out=p)
+    # Apply substantial blur to smooth the edges
+    _energy_blur.smooth(p, out=p)
+    np.copyto(_right_half(out), p)
+    return _mirror(out)
+
+
+def visualize_scroll(y, out=None):
+    """Effect that originates in the center and scrolls outwards"""
+    if filters is None:
+        reset()
+    out = pixels if out is None else out
+    scaled = filters.inputs['gain']
+    np.square(y, out=scaled)
+    filters.update_many(('gain',))
+    scaled /= filters['gain']
+    scaled *= 255.0
+    # Scrolling effect window
+    _scroll[:, 1:] = _scroll[:, :-1]
+    np.multiply(_scroll, 0.98, out=_scroll)
+    _scroll_blur.smooth(_scroll, out=_scroll)
+    # Create new color originating at the center
+    _scroll[:, 0] = [int(level) for level in _band_levels(scaled)]
+    np.copyto(_right_half(out), _scroll)
+    return _mirror(out)
+
+
+def visualize_beat(y, out=None):
+    """Effect that flashes the whole strip on every onset and fades out
+
+    The color follows the loudest of the low, middle and high bands.
+    """
+    global _beat_level
+    if filters is None:
+        reset()
+    out = pixels if out is None else out
+    _beat_level = 1.0 if onsets.onset else _beat_level * BEAT_DECAY
+    levels = _band_levels(y)
+    peak = max(levels)
+    for channel, level in enumerate(levels):
+        out[channel].fill(255.0 * _beat_level * level / peak if peak > 0 else 0.0)
+    return out
+
+
+EFFECTS = {
+    'spectrum': visualize_spectrum,
+    'energy': visualize_energy,
+    'scroll': visualize_scroll,
+    'beat': visualize_beat,
+}
+"""Effects by name, each renders the mel energies of a frame into the pixels"""
+
+
+def set_effect(name):
+    """Switches the effect, also while the stream is running"""
+    if name not in EFFECTS:
+        raise ValueError('Unknown effect {!r}, one of {}'.format(name, ', '.join(EFFECTS)))
+    Utils.Effect = name
+    if pixels is not None:
+        pixels.fill(0.0)
 
+
+def led_color(pixels):
+    """Gamma corrects the pixels and reduces them to one RGB color
+
+    Clipping, truncation to integers and the gamma table never decrease, so
+    the brightest gamma corrected value of a channel is the gamma corrected
+    brightest value: the channels are reduced first and only three values
+    are looked up.
+
+    Returns
+    -------
+    color : tuple
+        The brightest gamma corrected (red, green, blue) value of the strip
+    """
+    if _gamma is None:
+        reset()
+    # Truncate values and cast to integer
+    peak = np.clip(np.max(pixels, axis=1), 0, 255).astype(int)
+    red, green, blue = _gamma[peak]
+    return int(red), int(green), int(blue)
+
+
+def led_pixels(pixels):
+    """Gamma corrects every pixel for strips that address each one
+
+    Returns
+    -------
+    strip : np.array
+        (N_PIXELS, 3) uint8 array of (red, green, blue) rows, in wire order.
+        The buffer is reused by the next call.
+    """
+    if _strip is None:
+        reset()
+    np.clip(pixels, 0, 255, out=_strip_clipped)
+    np.copyto(_strip_index, _strip_clipped, casting='unsafe')
+    np.take(_gamma8, _strip_index.T, out=_strip)
+    for channel, enabled in enumerate((Utils.RedMic, Utils.GreenMic, Utils.BlueMic)):
+        if not enabled:
+            _strip[:, channel] = 0
+    return _strip
+
+
+def _mask_color(red, green, blue):
+    """Clamps the color and blacks out the channels switched off in Utils"""
     if Utils.RedMic:
         if red >= 256:
             red = 255
@@ -128,95 +474,152 @@ async def updateLedColor(red, green, blue):
             blue = 255
     else:
         blue = 0
+    return red, green, blue
 
-    await Utils.client.writeColor(red, green, blue)
 
-async def updateLed():
-    """Writes new LED values to the Blinkstick.
-        This function updates the LED strip with new values.
+async def updateLedColor(red, green, blue):
+    red, green, blue = _mask_color(red, green, blue)
+    if Utils.sender is not None:
+        Utils.sender.submit_color(red, green, blue)
+    else:
+        await Utils.client.writeColor(red, green, blue)
+
+
+async def pulse(frame_time):
+    """Flashes PULSE_COLOR right away, ahead of any queued color
+
+    ``frame_time`` is when the audio of the onset was recorded, the delay
+    until the pulse is written is recorded in the onset detector.
     """
-    global pixels
-    
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels]
-    np.copy(pixels)
-    # Read the rgb values
-    r = p[0][:].astype(int)
-    g = p[1][:].astype(int)
-    b = p[2][:].astype(int)
+    global _pulse_frames
+    detector = onsets
+    _pulse_frames = max(int(round(PULSE_HOLD * Utils.FPS)), 1)
 
+    def sent(done):
+        detector.record_latency(done - frame_time)
 
-    medianRed = max(r)
-    medianGreen = max(g)
-    medianBlue= max(b)
+    color = _mask_color(*PULSE_COLOR)
+    if Utils.sender is not None:
+        Utils.sender.submit_pulse(*color, on_sent=sent)
+    elif hasattr(Utils.client, 'writePulse'):
+        await Utils.client.writePulse(*color, on_sent=sent)
+    else:
+        await Utils.client.writeColor(*color)
+        sent(time.perf_counter())
 
-    await updateLedColor(int(medianRed), int(medianGreen), int(medianBlue))
+async def updateLed():
+    """Writes new LED values to the Blinkstick.
+        This function updates the LED strip with new values, as one color
+        or pixel by pixel depending on the sink_shape of Utils.client.
+    """
+    client = Utils.client
+    if getattr(client, 'sink_shape', Utils.SINK_COLOR) == Utils.SINK_STRIP:
+        await client.writePixels(led_pixels(pixels))
+    else:
+        await updateLedColor(*led_color(pixels))
  
 async def start_stream():
-    frames_per_buffer = int(Utils.MIC_RATE / Utils.FPS)
-    stream = Utils.p.open(format=pyaudio.paInt16,
-                    channels=1,
-                    input_device_index=Utils.selectedInputDevice,
-                    rate=Utils.MIC_RATE,
-                    input=True,
-                    frames_per_buffer=frames_per_buffer)
-    overflows = 0
-    prev_ovf_time = time.time()
-    while True:
-        try:
-            if Utils.localAudio:
-                y = np.fromstring(stream.read(frames_per_buffer, exception_on_overflow=False), dtype=np.int16)
-                y = y.astype(np.float32)
-                stream.read(stream.get_read_available(), exception_on_overflow=False)
-                await microphone_update(y)
-            else:
-                break
-        except IOError:
-            overflows += 1
-            if time.time() > prev_ovf_time + 1:
-                prev_ovf_time = time.time()
-                print('Audio buffer has overflowed {} times'.format(overflows))
-    
-    stream.stop_stream()
-    stream.close()
-    Utils.p.terminate()
-    Utils.p = pyaudio.PyAudio()
-
-async def microphone_update(y):
-    global y_roll, prev_rms, prev_exp, prev_fps_update, pixels
-    # Normalize samples between 0 and 1
-    y = y / 2.0**15
-    # Construct a rolling window of audio samples
-    y_roll[:-1] = y_roll[1:]
-    y_roll[-1, :] = np.copy(y)
-    y_data = np.concatenate(y_roll, axis=0).astype(np.float32)
-    
-    vol = np.max(np.abs(y_data))
-    if False:
-        #print('No audio input. Volume below threshold. Volume:', vol)
-        #led.pixels = np.tile(0, (3, Utils.N_PIXELS))
-        #led.update()
-        pass
+    """Visualizes the microphone until Utils.localAudio is cleared
+
+    The stream and the sender are shut down however the loop ends, also
+    when a frame fails or the task is cancelled.
+    """
+    global capture
+    if engine is None:
+        reset()
+    capture = AudioCapture(samples_per_frame,
+                           device_index=Utils.selectedInputDevice,
+                           chunk_size=min(CAPTURE_CHUNK, samples_per_frame))
+    # Decouple the frame loop from the speed of the BLE link
+    Utils.sender = AdaptiveSender()
+    Utils.sender.start()
+    try:
+        capture.start()
+        overflows = 0
+        while Utils.localAudio:
+            y = await capture.read()
+            await microphone_update(y, capture.frame_time)
+            if capture.overflows != overflows:
+                overflows = capture.overflows
+                Utils.printLog('Audio buffer has overflowed {} times', overflows)
+    finally:
+        capture.stop()
+        capture = None
+        sender, Utils.sender = Utils.sender, None
+        await sender.stop()
+        Utils.p.terminate()
+        # Recreated on next use
+        del Utils.p
+
+
+def _window(y):
+    """Adds one frame of raw audio samples to the rolling window and windows it"""
+    engine.push(y)
+    return engine.window_frame()
+
+
+def _spectrum(work):
+    """Transforms the windowed samples, returns the magnitudes the mel bank uses"""
+    bins = dsp.mel_bins
+    return np.abs(engine.fft()[bins], out=engine.spectrum[bins])
+
+
+def _mel(YS):
+    """Construct a Mel filterbank from the FFT data"""
+    return dsp.mel_project(YS, out=mel_output)
+
+
+def _gain(mel):
+    """Scales the mel energies in place, normalizes and smooths them"""
+    # Scale data to values more suitable for visualization
+    np.square(mel, out=mel)
+    # Gain normalization
+    mel /= filters.update('mel_gain', gain_smoother.smooth_max(mel))
+    onsets.update(mel)
+    return filters.update('mel_smoothing', mel)
+
+
+def _visualize(mel):
+    """Map filterbank output onto LED strip with the selected effect"""
+    return EFFECTS[Utils.Effect](mel, pixels)
+
+
+STAGES = (('window', _window), ('fft', _spectrum), ('mel', _mel),
+          ('gain', _gain), ('visualize', _visualize))
+"""(name, function) of each step of process_frame, in order, each takes
+what the one before returned. benchmark.py times them one by one."""
+
+
+def process_mel(mel):
+    """Maps one frame of mel filterbank energies onto the LED strip
+
+    ``mel`` is scaled in place. Returns the (3, N_PIXELS) pixel buffer the
+    effect selected by ``Utils.Effect`` rendered into.
+    """
+    if filters is None:
+        reset()
+    return _visualize(_gain(mel))
+
+
+def process_frame(y):
+    """Runs one frame of raw audio samples through the visualization"""
+    if engine is None:
+        reset()
+    for _, stage in STAGES:
+        y = stage(y)
+    return y
+
+
+async def microphone_update(y, frame_time=None):
+    """Visualizes one frame of audio recorded at frame_time (default: now)"""
+    global prev_fps_update, pixels, _pulse_frames
+    if frame_time is None:
+        frame_time = time.perf_counter()
+    pixels = process_frame(y)
+    if onsets.onset and Utils.OnsetPulse:
+        await pulse(frame_time)
+    elif _pulse_frames:
+        # Let the pulse show before the next color replaces it
+        _pulse_frames -= 1
     else:
-        # Transform audio input into the frequency domain
-        N = len(y_data)
-        N_zeros = 2**int(np.ceil(np.log2(N))) - N
-        # Pad with zeros until the next power of two
-        y_data *= fft_window
-        y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-        YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
-        # Construct a Mel filterbank from the FFT data
-        mel = np.atleast_2d(YS).T * dsp.mel_y.T
-        # Scale data to values more suitable for visualization
-        # mel = np.sum(mel, axis=0)
-        mel = np.sum(mel, axis=0)
-        mel = mel**2.0
-        # Gain normalization
-        mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
-        mel /= mel_gain.value
-        mel = mel_smoothing.update(mel)
-        # Map filterbank output onto LED strip
-        pixels = visualize_spectrum(mel)
         await updateLed()
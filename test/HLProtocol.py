@@ -0,0 +1,79 @@
+"""Encoder and decoder for the HappyLighting BLE commands.
+
+Packet layouts (one byte per field):
+
+    color   0x56 R G B 0x19 0xF0 0xAA
+    power   0xCC 0x23|0x24 0x33              (on | off)
+    mode    0xBB MODE SPEED 0x44
+    mic     0x01 0xF0|0x0F 0x32|0x1E 0x00 0x00 0x18  (enable | disable)
+"""
+import struct
+from collections import namedtuple
+
+COLOR = 0x56
+POWER = 0xCC
+MODE = 0xBB
+MIC = 0x01
+
+COLOR_BRIGHTNESS = int(10 * 255 / 100) & 0xFF
+"""Fixed fourth byte of the color packet, as sent by the original app"""
+
+_COLOR = struct.Struct('7B')
+_MODE = struct.Struct('4B')
+
+POWER_ON = bytes((POWER, 0x23, 0x33))
+POWER_OFF = bytes((POWER, 0x24, 0x33))
+MIC_ON = bytes((MIC, 0xF0, 0x32, 0x00, 0x00, 0x18))
+MIC_OFF = bytes((MIC, 0x0F, 0x1E, 0x00, 0x00, 0x18))
+
+Command = namedtuple('Command', ['kind', 'args'])
+"""A decoded packet, e.g. Command('color', (255, 0, 0))"""
+
+
+class HLCodec:
+    """Encodes commands into packet buffers owned by the codec
+
+    The color and mode packets are packed into the same bytearray on every
+    call, so a returned packet is only valid until the next call of the same
+    method. Use one codec per connection.
+    """
+    def __init__(self):
+        self._color = bytearray(_COLOR.size)
+        self._mode = bytearray(_MODE.size)
+
+    def color(self, red, green, blue):
+        _COLOR.pack_into(self._color, 0, COLOR, red, green, blue,
+                         COLOR_BRIGHTNESS, 0xF0, 0xAA)
+        return self._color
+
+    def power(self, state):
+        """state is "On" or "Off", as in QBleakClient.writePower"""
+        return POWER_OFF if state == "Off" else POWER_ON
+
+    def mode(self, mode, speed):
+        _MODE.pack_into(self._mode, 0, MODE, mode, speed & 0xFF, 0x44)
+        return self._mode
+
+    def mic(self, enable):
+        return MIC_ON if enable else MIC_OFF
+
+
+def decode(packet):
+    """Parses a packet written to the controller back into a Command
+
+    Raises ValueError for anything that is not a HappyLighting command.
+    """
+    packet = bytes(packet)
+    if len(packet) == _COLOR.size and packet[0] == COLOR:
+        return Command('color', tuple(packet[1:4]))
+    if packet == POWER_ON:
+        return Command('power', 'On')
+    if packet == POWER_OFF:
+        return Command('power', 'Off')
+    if len(packet) == _MODE.size and packet[0] == MODE and packet[3] == 0x44:
+        return Command('mode', (packet[1], packet[2]))
+    if packet == MIC_ON:
+        return Command('mic', True)
+    if packet == MIC_OFF:
+        return Command('mic', False)
+    raise ValueError('Unknown packet: {}'.format(packet.hex()))
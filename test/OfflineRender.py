@@ -0,0 +1,107 @@
+"""Renders a WAV file through the audio visualization without a microphone
+or BLE device, as fast as the CPU allows.
+
+Usage: python OfflineRender.py track.wav -o track.npz
+"""
+from __future__ import print_function
+import argparse
+import time
+import wave
+import numpy as np
+import Utils
+import dsp
+import ExternalAudio
+
+
+def read_wav(path):
+    """Reads a PCM WAV file as mono float32 samples at int16 scale
+
+    Returns
+    -------
+    samples : np.array
+        Samples in the same range as the int16 microphone input
+
+    rate : int
+        Sampling frequency of the file in Hz
+    """
+    with wave.open(path, 'rb') as wav:
+        width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+    if width == 1:
+        data = np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        data = ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8).astype(np.float32)
+    elif width in (2, 4):
+        data = np.frombuffer(raw, dtype='<i{}'.format(width)).astype(np.float32)
+    else:
+        raise ValueError('Unsupported sample width: {} bytes'.format(width))
+    data = data.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    data *= np.float32(2.0**15 / 2.0**(8 * width - 1))
+    return data, rate
+
+
+def render(samples, rate=Utils.MIC_RATE, batch_size=512):
+    """Runs audio samples through the visualization of ExternalAudio
+
+    The windowing, FFT and mel projection of ``batch_size`` frames are done
+    in one vectorized call, the stateful filters and effect then run frame
+    by frame exactly as in ``ExternalAudio.microphone_update``.
+
+    Returns
+    -------
+    timestamps : np.array
+        Time in seconds at which each frame's audio is complete
+
+    colors : np.array
+        (frames x 3) uint8 array of the gamma corrected RGB colors
+    """
+    if rate != Utils.MIC_RATE:
+        t = np.arange(int(len(samples) * Utils.MIC_RATE / rate)) / Utils.MIC_RATE
+        samples = np.interp(t, np.arange(len(samples)) / rate, samples)
+    ExternalAudio.reset()
+    frame_size = ExternalAudio.samples_per_frame
+    n_frames = len(samples) // frame_size
+    frames = np.asarray(samples[:n_frames * frame_size], dtype=np.float32)
+    frames = frames.reshape(n_frames, frame_size)
+
+    colors = np.zeros((n_frames, 3), dtype=np.uint8)
+    for start in range(0, n_frames, batch_size):
+        spectra = ExternalAudio.engine.update_batch(
+            frames[start:start + batch_size], dsp.mel_bins)
+        for i, mel in enumerate(dsp.mel_project(spectra), start):
+            colors[i] = ExternalAudio.led_color(ExternalAudio.process_mel(mel))
+    timestamps = np.arange(1, n_frames + 1) * frame_size / Utils.MIC_RATE
+    return timestamps, colors
+
+
+def render_wav(path, batch_size=512):
+    """Renders a WAV file, see render()"""
+    samples, rate = read_wav(path)
+    return render(samples, rate, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('wav', help='PCM WAV file to render')
+    parser.add_argument('-o', '--output',
+                        help='.npz file to write timestamps and colors to')
+    parser.add_argument('--batch', type=int, default=512,
+                        help='frames transformed per vectorized FFT call')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    timestamps, colors = render_wav(args.wav, args.batch)
+    elapsed = time.perf_counter() - start
+    duration = timestamps[-1] if len(timestamps) else 0.0
+    print('Rendered {} frames ({:.1f} s of audio) in {:.2f} s, {:.0f}x real time'.format(
+        len(colors), duration, elapsed, duration / max(elapsed, 1e-9)))
+    if args.output:
+        np.savez(args.output, timestamps=timestamps, colors=colors)
+        print('Saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,22 @@
 import serial as pyserial
+import serial.tools.list_ports
 import asyncio
+import selectors
+import socket
 import threading
-import time
+import Utils
+import SerialProtocol
 
 
 class ArduinoSerialListener:
-    def __init__(self):
+    def __init__(self, baudrate=None, protocol="text"):
+        """protocol is "text" (newline commands) or "binary" (SerialProtocol frames)"""
+        assert protocol in ("text", "binary"), "Invalid serial protocol"
         self.port = None
-        self.baudrate = 9600
+        self.protocol = protocol
+        if baudrate is None:
+            baudrate = 9600 if protocol == "text" else SerialProtocol.BINARY_BAUDRATE
+        self.baudrate = baudrate
         self.serial = None
         self.is_connected = False
         self.is_listening = False
@@ -20,8 +29,6 @@ class ArduinoSerialListener:
 
         if not self.port:
             # Try to auto-detect a port if none specified
-            import serial.tools.list_ports
-
             ports = list(serial.tools.list_ports.comports())
             if ports:
                 self.port = ports[0].device
@@ -56,104 +63,374 @@ class ArduinoSerialListener:
             print(f"Error disconnecting from Arduino: {e}")
             return False
 
-    async def start_listening(self, ble_client):
-        """Start listening for Arduino commands and forward them to BLE"""
-        if not self.is_connected or not self.serial:
-            print("Cannot start listening: Not connected to Arduino")
-            return False
+    def _make_parser(self):
+        if self.protocol == "binary":
+            return SerialProtocol.FrameParser()
+        return SerialProtocol.LineParser()
 
-        self.is_listening = True
-        self._stop_event.clear()
-        print("Started listening for Arduino commands")
+    async def _dispatch(self, commands, ble_client):
+        """Acts on the lines or frames of one read"""
+        if self.protocol == "binary":
+            await self._handle_frames(commands, ble_client)
+        else:
+            for line in commands:
+                await self._handle_line(line, ble_client)
+
+    def _read(self, loop, received):
+        """Reader thread: pushes parsed commands into the asyncio queue
 
+        Blocks in serial.read() instead of polling and parses everything that
+        arrived in one go, so commands reach the event loop as soon as they
+        are complete. Each queue item is the list of lines or frames from one
+        read, None marks the end.
+        """
+        parser = self._make_parser()
         try:
             while not self._stop_event.is_set():
-                if self.serial.in_waiting > 0:
-                    line = (
-                        self.serial.readline().decode("utf-8", errors="replace").strip()
-                    )
-                    if line:
-                        print(f"Arduino sent: {line}")
-
-                        # Simple on/off commands - handle multiple formats
-                        if (
-                            line.upper() == "ON"
-                            or line == "POWER:ON"
-                            or line == "LED:ON"
-                        ):
-                            await ble_client.writePower("On")
-                            self.serial.write("ACK:ON\n".encode())
-                            print("Turned LED ON via Arduino command")
-
-                        elif (
-                            line.upper() == "OFF"
-                            or line == "POWER:OFF"
-                            or line == "LED:OFF"
-                        ):
-                            await ble_client.writePower("Off")
-                            self.serial.write("ACK:OFF\n".encode())
-                            print("Turned LED OFF via Arduino command")
-
-                # Small delay to avoid tight loop
-                await asyncio.sleep(0.1)
-
+                data = self.serial.read(self.serial.in_waiting or 1)
+                if data:
+                    commands = parser.feed(data)
+                    if commands:
+                        loop.call_soon_threadsafe(received.put_nowait, commands)
         except Exception as e:
-            print(f"Error in Arduino listener: {e}")
+            if not self._stop_event.is_set():
+                loop.call_soon_threadsafe(received.put_nowait, e)
         finally:
-            self.is_listening = False
-
-        return True
+            loop.call_soon_threadsafe(received.put_nowait, None)
 
-    async def start_listening_test_mode(self):
-        """Test mode - just log commands without forwarding to BLE"""
-        if not self.is_connected or not hasattr(self, "serial") or not self.serial:
+    async def _listen(self, ble_client):
+        """Dispatches Arduino lines until stopped, ble_client None is test mode"""
+        if not self.is_connected or not self.serial:
             print("Cannot start listening: Not connected to Arduino")
             return False
 
         self.is_listening = True
         self._stop_event.clear()
-        print(
-            "Started listening for Arduino commands in TEST MODE (commands will be logged only)"
-        )
+        if ble_client is None:
+            print(
+                "Started listening for Arduino commands in TEST MODE (commands will be logged only)"
+            )
+        else:
+            print("Started listening for Arduino commands")
 
+        received = asyncio.Queue()
+        reader = threading.Thread(
+            target=self._read,
+            args=(asyncio.get_running_loop(), received),
+            name="ArduinoSerialReader",
+            daemon=True,
+        )
+        reader.start()
         try:
-            while not self._stop_event.is_set():
-                if self.serial.in_waiting > 0:
-                    line = (
-                        self.serial.readline().decode("utf-8", errors="replace").strip()
-                    )
-                    if line:
-                        print(f"Arduino sent (TEST MODE): {line}")
-
-                        # Simple on/off commands - just acknowledge in test mode
-                        if (
-                            line.upper() == "ON"
-                            or line == "POWER:ON"
-                            or line == "LED:ON"
-                        ):
-                            self.serial.write("ACK:ON\n".encode())
-                            print("Would turn LED ON (test mode)")
-
-                        elif (
-                            line.upper() == "OFF"
-                            or line == "POWER:OFF"
-                            or line == "LED:OFF"
-                        ):
-                            self.serial.write("ACK:OFF\n".encode())
-                            print("Would turn LED OFF (test mode)")
-
-                # Small delay to avoid tight loop
-                await asyncio.sleep(0.1)
+            while True:
+                commands = await received.get()
+                if commands is None:
+                    break
+                if isinstance(commands, Exception):
+                    raise commands
+                await self._dispatch(commands, ble_client)
 
         except Exception as e:
-            print(f"Error in Arduino test listener: {e}")
+            if ble_client is None:
+                print(f"Error in Arduino test listener: {e}")
+            else:
+                print(f"Error in Arduino listener: {e}")
         finally:
+            self._stop_event.set()
             self.is_listening = False
 
         return True
 
+    async def _handle_line(self, line, ble_client):
+        """Acts on one line from the Arduino, only logging it in test mode"""
+        test_mode = ble_client is None
+        if test_mode:
+            print(f"Arduino sent (TEST MODE): {line}")
+        else:
+            print(f"Arduino sent: {line}")
+
+        # Simple on/off commands - handle multiple formats
+        if line.upper() == "ON" or line == "POWER:ON" or line == "LED:ON":
+            if test_mode:
+                self.serial.write("ACK:ON\n".encode())
+                print("Would turn LED ON (test mode)")
+            else:
+                await ble_client.writePower("On")
+                self.serial.write("ACK:ON\n".encode())
+                print("Turned LED ON via Arduino command")
+
+        elif line.upper() == "OFF" or line == "POWER:OFF" or line == "LED:OFF":
+            if test_mode:
+                self.serial.write("ACK:OFF\n".encode())
+                print("Would turn LED OFF (test mode)")
+            else:
+                await ble_client.writePower("Off")
+                self.serial.write("ACK:OFF\n".encode())
+                print("Turned LED OFF via Arduino command")
+
+    async def _handle_frames(self, frames, ble_client):
+        """Acts on binary frames, only logging them in test mode
+
+        Only the newest of several color frames received together is sent,
+        older ones would be overwritten on the strip right away.
+        """
+        test_mode = ble_client is None
+        last_color = max((i for i, frame in enumerate(frames)
+                          if frame.type == SerialProtocol.COLOR), default=None)
+        for i, frame in enumerate(frames):
+            Utils.printLog("Arduino frame type {} payload {}", frame.type, frame.payload.hex())
+            if frame.type == SerialProtocol.COLOR and len(frame.payload) == 3:
+                if i == last_color and not test_mode:
+                    await ble_client.writeColor(*frame.payload)
+                continue
+            if frame.type == SerialProtocol.POWER and len(frame.payload) == 1:
+                state = "On" if frame.payload[0] else "Off"
+                if not test_mode:
+                    await ble_client.writePower(state)
+            elif frame.type == SerialProtocol.MODE and len(frame.payload) == 1:
+                if frame.payload[0] >= len(Utils.Modes):
+                    print(f"Arduino sent unknown mode {frame.payload[0]}")
+                    continue
+                if not test_mode:
+                    await ble_client.writeMode(frame.payload[0])
+            elif frame.type == SerialProtocol.SPEED and len(frame.payload) == 1:
+                Utils.Speed = frame.payload[0]
+            elif frame.type == SerialProtocol.ACK:
+                continue
+            else:
+                print(f"Arduino sent unknown frame type {frame.type}")
+                continue
+            self.serial.write(SerialProtocol.encode(SerialProtocol.ACK, bytes((frame.type,))))
+
+    async def start_listening(self, ble_client):
+        """Start listening for Arduino commands and forward them to BLE"""
+        return await self._listen(ble_client)
+
+    async def start_listening_test_mode(self):
+        """Test mode - just log commands without forwarding to BLE"""
+        return await self._listen(None)
+
     def stop_listening(self):
         """Stop listening for Arduino commands"""
         self._stop_event.set()
+        # Wake the reader thread out of its blocking read
+        if self.serial and hasattr(self.serial, "cancel_read"):
+            try:
+                self.serial.cancel_read()
+            except Exception:
+                pass
         self.is_listening = False
         print("Stopped listening for Arduino commands")
+
+
+class PortWatcher:
+    """Reports serial ports appearing and disappearing
+
+    Polls the port list in the background (off the event loop) and calls
+    ``callback(added, removed)`` with the device names whenever it changes.
+    """
+    def __init__(self, callback, interval=1.0, port_filter=None):
+        self.callback = callback
+        self.interval = interval
+        self.port_filter = port_filter
+        self.ports = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _scan(self):
+        return {
+            port.device: port
+            for port in serial.tools.list_ports.comports()
+            if self.port_filter is None or self.port_filter(port)
+        }
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            ports = await loop.run_in_executor(None, self._scan)
+            added = sorted(set(ports) - set(self.ports))
+            removed = sorted(set(self.ports) - set(ports))
+            self.ports = ports
+            if added or removed:
+                self.callback(added, removed)
+            await asyncio.sleep(self.interval)
+
+
+class SerialHub:
+    """Listens to many Arduino boards on a single selector-based I/O thread
+
+    Every port is an ArduinoSerialListener for opening, parsing and acting
+    on commands, but none of them runs its own reader. One thread waits on
+    all open ports with a selector and hands the parsed commands to the
+    event loop. Commands of a port go to its routed target (any object with
+    the QBleakClient write methods), or to ``Utils.client`` when it has
+    none (test mode, commands are only logged, when that is None too).
+    With ``auto_open`` new ports are opened as they are plugged in.
+    """
+    def __init__(self, baudrate=None, protocol="text", auto_open=False,
+                 port_filter=None, scan_interval=1.0):
+        self.baudrate = baudrate
+        self.protocol = protocol
+        self.auto_open = auto_open
+        self.listeners = {}
+        self.routes = {}
+        self.watcher = PortWatcher(self._ports_changed, scan_interval, port_filter)
+        self.on_ports_changed = None
+        self._stop_event = threading.Event()
+        self._opening = set()
+        # Wakes the I/O thread out of select(), created by run()
+        self._wake_r = self._wake_w = None
+        self._received = None
+        self._loop = None
+
+    def route(self, port, target):
+        """Sends the commands of port to target (None: Utils.client)"""
+        self.routes[port] = target
+
+    async def open(self, port, target=None, protocol=None):
+        """Opens a port (off the event loop) and adds it to the I/O thread"""
+        if port in self.listeners or port in self._opening:
+            return True
+        listener = ArduinoSerialListener(self.baudrate, protocol or self.protocol)
+        self._opening.add(port)
+        try:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, listener.connect, port):
+                return False
+        finally:
+            self._opening.discard(port)
+        if target is not None:
+            self.routes[port] = target
+        self.listeners[port] = listener
+        self._wake()
+        return True
+
+    def close(self, port):
+        listener = self.listeners.pop(port, None)
+        if listener is not None:
+            self._wake()
+            listener.disconnect()
+
+    def _wake(self):
+        if self._wake_w is None:
+            return
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _ports_changed(self, added, removed):
+        for port in removed:
+            if port in self.listeners:
+                print(f"Arduino on {port} was unplugged")
+                self.close(port)
+        if self.auto_open:
+            for port in added:
+                asyncio.ensure_future(self.open(port))
+        if self.on_ports_changed is not None:
+            self.on_ports_changed(added, removed)
+
+    def _io_thread(self, wake):
+        """Waits on every open port, reads and parses what arrives"""
+        selector = selectors.DefaultSelector()
+        selector.register(wake, selectors.EVENT_READ, None)
+        registered = {}
+        parsers = {}
+        # Ports without a selectable handle (Windows) are polled instead
+        polled = set()
+        try:
+            while not self._stop_event.is_set():
+                listeners = dict(self.listeners)
+                for port in list(registered):
+                    if port not in listeners:
+                        selector.unregister(registered.pop(port))
+                for port in list(parsers):
+                    if port not in listeners:
+                        del parsers[port]
+                        polled.discard(port)
+                for port, listener in listeners.items():
+                    if port in parsers:
+                        continue
+                    parsers[port] = listener._make_parser()
+                    try:
+                        selector.register(listener.serial.fileno(), selectors.EVENT_READ, port)
+                        registered[port] = listener.serial.fileno()
+                    except (AttributeError, KeyError, OSError, ValueError):
+                        polled.add(port)
+
+                ready = list(polled)
+                for key, _ in selector.select(0.01 if polled else None):
+                    if key.data is None:
+                        wake.recv(4096)
+                    else:
+                        ready.append(key.data)
+                for port in ready:
+                    listener = listeners[port]
+                    try:
+                        waiting = listener.serial.in_waiting
+                        if port in polled and not waiting:
+                            continue
+                        data = listener.serial.read(waiting or 1)
+                    except Exception as e:
+                        print(f"Error reading Arduino on {port}: {e}")
+                        self._loop.call_soon_threadsafe(self.close, port)
+                        continue
+                    commands = parsers[port].feed(data)
+                    if commands:
+                        self._loop.call_soon_threadsafe(
+                            self._received.put_nowait, (port, commands)
+                        )
+        finally:
+            selector.close()
+            self._loop.call_soon_threadsafe(self._received.put_nowait, None)
+
+    async def run(self):
+        """Dispatches commands of every port until stop() is called"""
+        self._loop = asyncio.get_running_loop()
+        self._received = asyncio.Queue()
+        self._stop_event.clear()
+        self._wake_r, self._wake_w = socket.socketpair()
+        io_thread = threading.Thread(target=self._io_thread, args=(self._wake_r,),
+                                     name="ArduinoSerialHub", daemon=True)
+        io_thread.start()
+        self.watcher.start()
+        try:
+            while True:
+                item = await self._received.get()
+                if item is None:
+                    break
+                port, commands = item
+                listener = self.listeners.get(port)
+                if listener is None:
+                    continue
+                # An empty DeviceGroup is falsy but still a valid route
+                target = self.routes.get(port)
+                if target is None:
+                    target = Utils.client
+                try:
+                    await listener._dispatch(commands, target)
+                except Exception as e:
+                    print(f"Error handling Arduino on {port}: {e}")
+        finally:
+            self._stop_event.set()
+            self._wake()
+            self.watcher.stop()
+            io_thread.join(1.0)
+            wake_r, wake_w = self._wake_r, self._wake_w
+            self._wake_r = self._wake_w = None
+            wake_r.close()
+            wake_w.close()
+            for port in list(self.listeners):
+                self.close(port)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake()
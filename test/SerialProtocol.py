@@ -0,0 +1,101 @@
+"""Wire formats spoken by the Arduino sensor boards.
+
+Text protocol (default, 9600 baud): newline terminated commands such as
+"ON", "POWER:OFF" or "LED:ON", acknowledged with "ACK:ON\\n".
+
+Binary protocol (BINARY_BAUDRATE by default): frames of
+
+    0xA5 | LEN | TYPE | PAYLOAD (LEN bytes) | CHK
+
+where CHK is the XOR of LEN, TYPE and every payload byte. Payloads:
+
+    POWER       1 byte, 0 = off, anything else = on
+    COLOR       3 bytes, red green blue
+    MODE        1 byte, index into Utils.Modes
+    SPEED       1 byte, Utils.Speed used by following mode changes
+    ACK         1 byte, TYPE of the acknowledged frame (host to Arduino)
+"""
+from collections import namedtuple
+
+SYNC = 0xA5
+MAX_PAYLOAD = 32
+BINARY_BAUDRATE = 115200
+
+POWER = 0x01
+COLOR = 0x02
+MODE = 0x03
+SPEED = 0x04
+ACK = 0x7F
+
+Frame = namedtuple('Frame', ['type', 'payload'])
+
+
+def checksum(data):
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def encode(frame_type, payload=b''):
+    """Builds one binary frame"""
+    body = bytes((len(payload), frame_type)) + bytes(payload)
+    return bytes((SYNC,)) + body + bytes((checksum(body),))
+
+
+class LineParser:
+    """Splits the text protocol into stripped, non-empty lines"""
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Adds received bytes, returns the lines they completed"""
+        self.buffer += data
+        complete = self.buffer.split(b'\n')
+        self.buffer = complete.pop()
+        lines = (raw.decode('utf-8', errors='replace').strip() for raw in complete)
+        return [line for line in lines if line]
+
+
+class FrameParser:
+    """Parses binary frames out of a byte stream
+
+    Everything received is appended to one buffer and parsed in bulk;
+    garbage and frames with a bad checksum are skipped by resynchronizing
+    on the next SYNC byte and counted in ``errors``.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        """Adds received bytes, returns the Frames they completed"""
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                pos = len(buffer)
+                break
+            if len(buffer) - start < 2:
+                pos = start
+                break
+            length = buffer[start + 1]
+            if length > MAX_PAYLOAD:
+                self.errors += 1
+                pos = start + 1
+                continue
+            end = start + length + 4
+            if len(buffer) < end:
+                pos = start
+                break
+            if checksum(buffer[start + 1:end - 1]) != buffer[end - 1]:
+                self.errors += 1
+                pos = start + 1
+                continue
+            frames.append(Frame(buffer[start + 2], bytes(buffer[start + 3:end - 1])))
+            pos = end
+        del buffer[:pos]
+        return frames
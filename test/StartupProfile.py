@@ -0,0 +1,99 @@
+"""Startup timing report: how long each module import and init step takes.
+
+Enabled by passing ``--startup-report`` to pyhl.py / pyhld.py or by setting
+the PYHL_STARTUP_REPORT environment variable. ``install()`` has to run
+before the imports it should see, so the entry points call it first thing:
+
+    import StartupProfile
+    StartupProfile.install()
+    ...
+    with StartupProfile.step('MainWindow'):
+        w = MainWindow()
+    StartupProfile.report()
+
+Imports are timed when a module is first imported, ``self`` excludes the
+time spent importing the modules it imports in turn (like
+``python -X importtime``). Lazily initialized state (PyAudio, mel bank,
+audio buffers) is timed with ``step`` when it is first used.
+"""
+import builtins
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+enabled = False
+imports = []
+"""(module, cumulative seconds, self seconds, depth) of every timed import"""
+steps = []
+"""(name, seconds) of every timed init step"""
+
+_start = None
+_stack = []
+_import = builtins.__import__
+
+
+def requested(argv=None):
+    """Whether the report was asked for on the command line or environment"""
+    argv = sys.argv if argv is None else argv
+    return '--startup-report' in argv or bool(os.environ.get('PYHL_STARTUP_REPORT'))
+
+
+def install(force=False):
+    """Starts timing imports and steps, if requested (or force)"""
+    global enabled, _start
+    if enabled or not (force or requested()):
+        return
+    enabled = True
+    _start = time.perf_counter()
+    builtins.__import__ = _timed_import
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    clock = time.perf_counter
+    _stack.append(0.0)
+    start = clock()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = clock() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        imports.append((name, elapsed, elapsed - children, len(_stack)))
+
+
+@contextmanager
+def step(name):
+    """Times the block as an init step when the report is enabled"""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        steps.append((name, time.perf_counter() - start))
+
+
+def report(limit=15, file=None):
+    """Prints the slowest imports and every init step"""
+    if not enabled:
+        return
+    file = file or sys.stdout
+    total = time.perf_counter() - _start
+    print('Startup: {:.0f} ms since StartupProfile.install()'.format(total * 1e3),
+          file=file)
+    top_level = sum(cumulative for _, cumulative, _, depth in imports if depth == 0)
+    print('  imports {:.0f} ms, slowest by self time:'.format(top_level * 1e3),
+          file=file)
+    print('    {:>9} {:>9}  module'.format('self ms', 'total ms'), file=file)
+    for name, cumulative, own, _ in sorted(imports, key=lambda i: -i[2])[:limit]:
+        print('    {:9.1f} {:9.1f}  {}'.format(own * 1e3, cumulative * 1e3, name),
+              file=file)
+    if steps:
+        print('  init steps:', file=file)
+        for name, elapsed in steps:
+            print('    {:9.1f}            {}'.format(elapsed * 1e3, name), file=file)
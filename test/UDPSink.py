@@ -0,0 +1,265 @@
+"""Per-pixel output to ESP8266/WLED style strips over UDP.
+
+UDPStripSink is a strip sink (sink_shape Utils.SINK_STRIP) that can be
+used as ``Utils.client``: updateLed hands it the gamma corrected
+(N_PIXELS, 3) uint8 strip, see ExternalAudio.led_pixels.
+
+    sink = UDPStripSink('192.168.1.50', protocol='ddp')
+    await sink.start()
+    Utils.client = sink
+
+Packet formats:
+
+    drgb    WLED realtime, port 21324: 0x02 | TIMEOUT | RGB...
+            one packet, at most DRGB_MAX_PIXELS
+    dnrgb   WLED realtime, port 21324: 0x04 | TIMEOUT | START (2 bytes) | RGB...
+            DNRGB_MAX_PIXELS per packet, START is the index of the first pixel
+    ddp     Distributed Display Protocol, port 4048, 10 byte header
+            FLAGS | SEQUENCE | TYPE | ID | OFFSET (4 bytes) | LENGTH (2 bytes)
+            DDP_MAX_DATA bytes per packet, OFFSET in bytes, the push flag
+            on the last packet of a frame makes the strip show it
+
+Multi-byte fields are big endian. TIMEOUT is the number of seconds WLED
+keeps showing the realtime data after the last packet.
+
+The packets are laid out once per strip length in reusable buffers.
+Where the platform has socket.sendmsg the header and a memoryview of the
+strip go out as one datagram without copying the pixels, elsewhere the
+pixels are copied into the payload of the packet buffer first.
+
+UDPStripReceiver parses all three formats back into a pixel array, for
+loopback tests and ``benchmark.py udp``.
+"""
+import asyncio
+import socket
+import numpy as np
+import Utils
+
+WLED_PORT = 21324
+DDP_PORT = 4048
+
+DRGB = 0x02
+DNRGB = 0x04
+DRGB_MAX_PIXELS = 490
+DNRGB_MAX_PIXELS = 489
+
+DDP_VERSION = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_ID_DISPLAY = 0x01
+DDP_HEADER = 10
+DDP_MAX_DATA = 1440
+
+PROTOCOLS = {'drgb': WLED_PORT, 'dnrgb': WLED_PORT, 'ddp': DDP_PORT}
+"""Supported packet formats and their default ports"""
+
+
+class UDPStripSink:
+    """Sends strips of pixels to an addressable LED controller over UDP
+
+    Parameters
+    ----------
+    host : str
+        Address of the controller
+
+    port : int
+        UDP port, defaults to the one of the protocol in PROTOCOLS
+
+    protocol : str
+        Packet format, one of PROTOCOLS
+
+    timeout : int
+        Seconds WLED shows the realtime data for (drgb and dnrgb only),
+        255 keeps it until the next packet
+    """
+    sink_shape = Utils.SINK_STRIP
+
+    def __init__(self, host, port=None, protocol='ddp', timeout=2):
+        if protocol not in PROTOCOLS:
+            raise ValueError('Unknown protocol {!r}, one of {}'.format(
+                protocol, ', '.join(PROTOCOLS)))
+        self.address = (host, port or PROTOCOLS[protocol])
+        self.protocol = protocol
+        self.timeout = timeout
+        self.frames = 0
+        self.packets = 0
+        self.dropped = 0
+        self.on = True
+        self._socket = None
+        self._packets = []
+        self._n_pixels = None
+        self._sequence = 0
+        self._fill = None
+        self._sendmsg = hasattr(socket.socket, 'sendmsg')
+
+    async def start(self):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        return True
+
+    async def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _layout(self, n_pixels):
+        """Builds the packet buffers of a strip of n_pixels
+
+        Each packet is (buffer, header length, first pixel, end pixel,
+        payload), payload being an (n, 3) array over the end of the buffer.
+        """
+        if self.protocol == 'drgb':
+            if n_pixels > DRGB_MAX_PIXELS:
+                raise ValueError('drgb carries at most {} pixels, use dnrgb or ddp '
+                                 'for {}'.format(DRGB_MAX_PIXELS, n_pixels))
+            per_packet, header_length = DRGB_MAX_PIXELS, 2
+        elif self.protocol == 'dnrgb':
+            per_packet, header_length = DNRGB_MAX_PIXELS, 4
+        else:
+            per_packet, header_length = DDP_MAX_DATA // 3, DDP_HEADER
+        self._packets = []
+        for start in range(0, n_pixels, per_packet):
+            end = min(start + per_packet, n_pixels)
+            buffer = bytearray(header_length + 3 * (end - start))
+            if self.protocol == 'drgb':
+                buffer[:2] = (DRGB, self.timeout)
+            elif self.protocol == 'dnrgb':
+                buffer[:2] = (DNRGB, self.timeout)
+                buffer[2:4] = start.to_bytes(2, 'big')
+            else:
+                buffer[0] = DDP_VERSION | (DDP_PUSH if end == n_pixels else 0)
+                buffer[2:4] = (DDP_TYPE_RGB24, DDP_ID_DISPLAY)
+                buffer[4:8] = (3 * start).to_bytes(4, 'big')
+                buffer[8:10] = (3 * (end - start)).to_bytes(2, 'big')
+            payload = np.frombuffer(buffer, dtype=np.uint8,
+                                    offset=header_length).reshape(-1, 3)
+            self._packets.append((buffer, header_length, start, end, payload))
+        self._n_pixels = n_pixels
+        self._fill = np.zeros((n_pixels, 3), dtype=np.uint8)
+
+    def _send(self, *buffers):
+        try:
+            if len(buffers) == 1:
+                self._socket.sendto(buffers[0], self.address)
+            else:
+                self._socket.sendmsg(buffers, (), 0, self.address)
+            self.packets += 1
+        except (BlockingIOError, InterruptedError):
+            # Socket buffer full, the next frame replaces this one anyway
+            self.dropped += 1
+
+    async def writePixels(self, strip):
+        """Sends one frame, strip is an (n, 3) uint8 array of (red, green, blue)
+
+        After writePower("Off") every frame is sent black until it is
+        switched on again.
+        """
+        if self._socket is None:
+            await self.start()
+        if len(strip) != self._n_pixels:
+            self._layout(len(strip))
+        if not self.on:
+            # Powered off: the strip stays dark whatever the effects render
+            self._fill.fill(0)
+            strip = self._fill
+        if self.protocol == 'ddp':
+            # Sequence numbers run from 1 to 15, 0 would disable the check
+            self._sequence = self._sequence % 15 + 1
+            for buffer, _, _, _, _ in self._packets:
+                buffer[1] = self._sequence
+        if self._sendmsg and strip.flags.c_contiguous and strip.dtype == np.uint8:
+            pixels = memoryview(strip).cast('B')
+            for buffer, header_length, start, end, _ in self._packets:
+                self._send(memoryview(buffer)[:header_length],
+                           pixels[3 * start:3 * end])
+        else:
+            for buffer, _, start, end, payload in self._packets:
+                np.copyto(payload, strip[start:end], casting='unsafe')
+                self._send(memoryview(buffer))
+        self.frames += 1
+
+    async def writeColor(self, R=0, G=0, B=0):
+        if self._fill is None:
+            self._layout(Utils.N_PIXELS)
+        self._fill[:] = (R, G, B)
+        await self.writePixels(self._fill)
+
+    async def writePower(self, state):
+        Utils.printLog("Strip Power : {}", state)
+        self.on = state != "Off"
+        if not self.on:
+            await self.writeColor()
+
+    async def writeMode(self, idx):
+        # The built-in modes are HappyLighting firmware features
+        Utils.printLog("Strip has no mode {}", idx)
+
+    async def writeMicState(self, enable):
+        Utils.printLog("Strip has no microphone, ignoring {}", enable)
+
+    def stats(self):
+        """Returns the sink counters as a dict"""
+        return {
+            'frames': self.frames,
+            'packets': self.packets,
+            'dropped': self.dropped,
+            'packets_per_frame': len(self._packets),
+        }
+
+
+class UDPStripReceiver(asyncio.DatagramProtocol):
+    """Receives drgb, dnrgb and ddp packets into ``pixels``, for testing
+
+    ``frames`` counts completed frames: every drgb packet, dnrgb packets
+    reaching the end of the strip and ddp packets with the push flag.
+    Packets that are malformed or do not fit the strip count as ``errors``.
+    """
+    def __init__(self, n_pixels):
+        self.pixels = np.zeros((n_pixels, 3), dtype=np.uint8)
+        self._flat = self.pixels.reshape(-1)
+        self.frames = 0
+        self.packets = 0
+        self.errors = 0
+        self.transport = None
+
+    @classmethod
+    async def listen(cls, n_pixels, host='127.0.0.1', port=0):
+        """Returns a receiver bound to host and port (0: any free port)"""
+        loop = asyncio.get_running_loop()
+        _, receiver = await loop.create_datagram_endpoint(
+            lambda: cls(n_pixels), local_addr=(host, port))
+        return receiver
+
+    @property
+    def address(self):
+        return self.transport.get_extra_info('sockname')
+
+    def close(self):
+        self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.packets += 1
+        kind = data[0] if data else None
+        if kind == DRGB and len(data) >= 2:
+            offset, payload, complete = 0, data[2:], True
+        elif kind == DNRGB and len(data) >= 4:
+            offset = 3 * int.from_bytes(data[2:4], 'big')
+            payload = data[4:]
+            complete = offset + len(payload) == len(self._flat)
+        elif kind is not None and kind & 0xC0 == DDP_VERSION and len(data) >= DDP_HEADER:
+            offset = int.from_bytes(data[4:8], 'big')
+            payload = data[DDP_HEADER:DDP_HEADER + int.from_bytes(data[8:10], 'big')]
+            complete = bool(kind & DDP_PUSH)
+        else:
+            self.errors += 1
+            return
+        if offset + len(payload) > len(self._flat) or len(payload) % 3:
+            self.errors += 1
+            return
+        self._flat[offset:offset + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        if complete:
+            self.frames += 1
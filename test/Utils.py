@@ -1,5 +1,5 @@
 import os
-import pyaudio
+import StartupProfile
 
 DEBUG_LOGS = False
 Modes = [37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 
@@ -7,7 +7,7 @@ Modes = [37, 38, 39, 40, 41, 42, 43, 44, 45, 46,
          97, 98, 99]
 
 InputDevices = {}
-p = pyaudio.PyAudio()
+# p, the shared pyaudio.PyAudio instance, is created on first use, see __getattr__
 selectedInputDevice = -1
 app = None
 captureMode = False
@@ -15,11 +15,20 @@ captureMode = False
 Speed = 0
 isModeUsed = False
 client = None
+sender = None
 
 localAudio = False
 GreenMic = True
 RedMic = True
 BlueMic = True
+OnsetPulse = True
+Effect = 'spectrum'
+"""Name of the audio effect, see ExternalAudio.EFFECTS"""
+
+SINK_COLOR = 'color'
+"""sink_shape of clients showing one color on the whole strip (writeColor)"""
+SINK_STRIP = 'strip'
+"""sink_shape of clients addressing every pixel (writePixels)"""
 
 N_PIXELS = 60
 """Number of pixels in the LED strip (must match ESP8266 firmware)"""
@@ -27,6 +36,9 @@ N_PIXELS = 60
 GAMMA_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'gamma_table.npy')
 """Location of the gamma correction table"""
 
+DEVICE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.pyhl', 'devices.json')
+"""Location of the per-device cache (GATT characteristics, known devices)"""
+
 MIC_RATE = 44100
 """Sampling frequency of the microphone in Hz"""
 
@@ -77,6 +89,18 @@ MIN_VOLUME_THRESHOLD = 1e-7
 """No music visualization displayed if recorded audio volume below threshold"""
 
 
-def printLog(text):
+def printLog(text, *args):
+    """Prints a debug message, formatting text with args only if DEBUG_LOGS is on"""
     if DEBUG_LOGS:
-        print("[+] {}".format(text))
+        print("[+] {}".format(text.format(*args) if args else text))
+
+
+def __getattr__(name):
+    # PyAudio() enumerates every audio host API, only pay for it when audio is used
+    global p
+    if name == 'p':
+        import pyaudio
+        with StartupProfile.step('pyaudio.PyAudio()'):
+            p = pyaudio.PyAudio()
+        return p
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
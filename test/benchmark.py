@@ -0,0 +1,723 @@
+"""Micro-benchmarks for the audio visualization pipeline.
+
+Run ``python benchmark.py`` to execute every benchmark or pass the names of
+the ones to run, e.g. ``python benchmark.py frame_engine``. The pipeline
+benchmark replaces ``Utils.client`` with a FakeClient, times each of
+ExternalAudio.STAGES and sweeps the settings given on the command line
+through ExternalAudio.config (invalid combinations are skipped), e.g.
+``python benchmark.py pipeline --pixels 60 300 --fps 30 60``.
+The footprint benchmark runs the visualization in a fresh process for the
+GUI (pyhl.py, Qt offscreen) and the headless (pyhld.py) setup each and
+compares their peak RSS and CPU time. The udp benchmark streams strips
+through UDPStripSink to a UDPStripReceiver on the loopback interface.
+"""
+from __future__ import print_function
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import Utils
+import dsp
+import melbank
+import ExternalAudio
+from BLESender import AdaptiveSender
+import HLProtocol
+import BLEClass
+from BLESimulator import SimDevice, SimulatedClient, private_device_cache
+from UDPSink import UDPStripSink, UDPStripReceiver, DRGB_MAX_PIXELS
+
+
+def _legacy_frame(y_roll, fft_window, y):
+    """Reference copy of the pre-FrameEngine windowing and FFT code"""
+    y = y / 2.0**15
+    y_roll[:-1] = y_roll[1:]
+    y_roll[-1, :] = np.copy(y)
+    y_data = np.concatenate(y_roll, axis=0).astype(np.float32)
+    N = len(y_data)
+    N_zeros = 2**int(np.ceil(np.log2(N))) - N
+    y_data *= fft_window
+    y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
+    return np.abs(np.fft.rfft(y_padded)[:N // 2])
+
+
+def _time_per_call(fn, frames, repeat=3):
+    """Best of ``repeat`` runs of fn over frames, in seconds per call"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for y in frames:
+            fn(y)
+        best = min(best, (time.perf_counter() - start) / len(frames))
+    return best
+
+
+def _allocated_per_call(fn, frames):
+    """Bytes allocated per call of fn over frames, as seen by tracemalloc"""
+    fn(frames[0])
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    total = 0
+    for y in frames:
+        fn(y)
+        total += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.reset_peak()
+    tracemalloc.stop()
+    return total / len(frames)
+
+
+def _random_frames(n_frames, frame_size, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(-2**15, 2**15, frame_size).astype(np.float32)
+            for _ in range(n_frames)]
+
+
+def bench_frame_engine(n_frames=2000):
+    """Legacy rolling window + padded FFT against dsp.FrameEngine"""
+    frame_size = int(Utils.MIC_RATE / Utils.FPS)
+    frames = _random_frames(n_frames, frame_size)
+
+    y_roll = np.zeros((Utils.N_ROLLING_HISTORY, frame_size))
+    fft_window = np.hamming(frame_size * Utils.N_ROLLING_HISTORY)
+    legacy = lambda y: _legacy_frame(y_roll, fft_window, y)
+    engine = dsp.FrameEngine(frame_size, Utils.N_ROLLING_HISTORY)
+
+    print('frame_engine: {} samples per frame, {} frame window'.format(
+        frame_size, Utils.N_ROLLING_HISTORY))
+    for name, fn in (('legacy', legacy), ('engine', engine.update)):
+        t = _time_per_call(fn, frames)
+        a = _allocated_per_call(fn, frames[:200])
+        print('  {:<8} {:8.1f} us/frame {:10.0f} B allocated/frame'.format(
+            name, t * 1e6, a))
+
+
+def bench_filters(n_frames=5000):
+    """Per-frame smoothing filter stage, ExpFilter instances vs ExpFilterBank"""
+    n_bins, n_half = Utils.N_FFT_BINS, Utils.N_PIXELS // 2
+    rng = np.random.default_rng(0)
+    frames = [(rng.random(n_bins), rng.random(n_half))
+              for _ in range(n_frames)]
+
+    mel_gain = dsp.ExpFilter(np.tile(1e-1, n_bins), 0.01, 0.99)
+    mel_smoothing = dsp.ExpFilter(np.tile(1e-1, n_bins), 0.5, 0.99)
+    common_mode = dsp.ExpFilter(np.tile(0.01, n_half), 0.99, 0.01)
+    r_filt = dsp.ExpFilter(np.tile(0.01, n_half), 0.2, 0.99)
+    b_filt = dsp.ExpFilter(np.tile(0.01, n_half), 0.1, 0.5)
+
+    def separate(frame):
+        mel, y = frame
+        mel_gain.update(np.max(mel))
+        mel_smoothing.update(mel / mel_gain.value)
+        common_mode.update(y)
+        r_filt.update(y - common_mode.value)
+        b_filt.update(np.copy(y))
+
+    bank = dsp.ExpFilterBank()
+    bank.add('mel_gain', np.tile(1e-1, n_bins), 0.01, 0.99)
+    bank.add('mel_smoothing', np.tile(1e-1, n_bins), 0.5, 0.99)
+    bank.add('common_mode', np.tile(0.01, n_half), 0.99, 0.01)
+    bank.add('r_filt', np.tile(0.01, n_half), 0.2, 0.99)
+    bank.add('b_filt', np.tile(0.01, n_half), 0.1, 0.5)
+
+    def banked(frame):
+        mel, y = frame
+        np.divide(mel, bank.update('mel_gain', np.max(mel)),
+                  out=bank.inputs['mel_smoothing'])
+        bank.update_many(('mel_smoothing',))
+        common_mode = bank.update('common_mode', y)
+        np.subtract(y, common_mode, out=bank.inputs['r_filt'])
+        np.copyto(bank.inputs['b_filt'], y)
+        bank.update_many(('r_filt', 'b_filt'))
+
+    print('filters: {} mel bins, {} pixels per channel'.format(n_bins, n_half))
+    for name, fn in (('ExpFilter', separate), ('bank', banked)):
+        t = _time_per_call(fn, frames)
+        a = _allocated_per_call(fn, frames[:500])
+        print('  {:<10} {:8.1f} us/frame {:10.0f} B allocated/frame'.format(
+            name, t * 1e6, a))
+
+
+class FakeClient:
+    """Stands in for Utils.client, accepts every write without any I/O"""
+    def __init__(self):
+        self.writes = 0
+
+    async def writeColor(self, R=0, G=0, B=0):
+        self.writes += 1
+
+    async def writePower(self, state):
+        self.writes += 1
+
+    async def writeMode(self, idx):
+        self.writes += 1
+
+    async def writeMicState(self, enable):
+        self.writes += 1
+
+
+def configure(**settings):
+    """Applies settings through ExternalAudio.config and rebuilds the audio state
+
+    Returns the previous values so they can be restored the same way.
+    Invalid settings raise ValueError.
+    """
+    previous = {name: getattr(ExternalAudio.config, name) for name in settings}
+    ExternalAudio.config.update(**settings)
+    ExternalAudio.reset()
+    return previous
+
+
+PIPELINE_STAGES = tuple(name for name, _ in ExternalAudio.STAGES) + ('gamma', 'updateLed')
+
+
+async def _run_pipeline(frames):
+    """Times each stage of microphone_update, returns (stage x frame) seconds"""
+    stages = [stage for _, stage in ExternalAudio.STAGES]
+    clock = time.perf_counter
+    times = np.zeros((len(PIPELINE_STAGES), len(frames)))
+    for i, y in enumerate(frames):
+        value = y
+        start = clock()
+        for j, stage in enumerate(stages):
+            value = stage(value)
+            done = clock()
+            times[j, i], start = done - start, done
+        color = ExternalAudio.led_color(value)
+        done = clock()
+        times[-2, i], start = done - start, done
+        await ExternalAudio.updateLedColor(*color)
+        times[-1, i] = clock() - start
+    return times
+
+
+def bench_pipeline(n_frames=1000, pixels=(30, 60, 150, 300), bins=(12, 24, 48),
+                   history=(2, 4), fps=(30, 60)):
+    """Per-stage latency of the audio-to-color pipeline over a settings sweep"""
+    client, Utils.client = Utils.client, FakeClient()
+    previous = ExternalAudio.config.as_dict()
+    print('pipeline: p50/p99 per stage in us, {} frames per setting'.format(n_frames))
+    print('  {:>6} {:>4} {:>4} {:>3} | {} | {:>15} {:>8} {:>8}'.format(
+        'pixels', 'bins', 'hist', 'fps',
+        ' '.join('{:>11}'.format(stage) for stage in PIPELINE_STAGES),
+        'frame p50/p99', 'max fps', 'headroom'))
+    try:
+        for n_pixels, n_bins, n_history, rate in itertools.product(
+                pixels, bins, history, fps):
+            try:
+                configure(N_PIXELS=n_pixels, N_FFT_BINS=n_bins,
+                          N_ROLLING_HISTORY=n_history, FPS=rate)
+            except ValueError as e:
+                print('  {:>6} {:>4} {:>4} {:>3} | skipped: {}'.format(
+                    n_pixels, n_bins, n_history, rate, e))
+                continue
+            frames = _random_frames(n_frames, ExternalAudio.samples_per_frame)
+            times = asyncio.run(_run_pipeline(frames)) * 1e6
+            p50, p99 = np.percentile(times, [50, 99], axis=1)
+            total = times.sum(axis=0)
+            total_p50, total_p99 = np.percentile(total, [50, 99])
+            print('  {:>6} {:>4} {:>4} {:>3} | {} | {:>7.0f}/{:<7.0f} {:>8.0f} {:>7.1f}x'.format(
+                n_pixels, n_bins, n_history, rate,
+                ' '.join('{:>5.0f}/{:<5.0f}'.format(a, b) for a, b in zip(p50, p99)),
+                total_p50, total_p99, 1e6 / total.mean(),
+                1e6 / rate / total_p99))
+    finally:
+        Utils.client = client
+        configure(**previous)
+
+
+class SlowClient(FakeClient):
+    """FakeClient whose writes take ``latency`` seconds, like a BLE link"""
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    async def writeColor(self, R=0, G=0, B=0):
+        await asyncio.sleep(self.latency)
+        self.writes += 1
+
+
+async def _run_sender(latency, seconds):
+    sender = AdaptiveSender(SlowClient(latency))
+    sender.start()
+    frame_time = 1.0 / Utils.FPS
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        sender.submit_color(frames % 256, 0, 0)
+        frames += 1
+        await asyncio.sleep(frame_time)
+    elapsed = time.perf_counter() - start
+    await sender.stop()
+    return frames / elapsed, sender.stats()
+
+
+def bench_sender(latencies=(0.005, 0.02, 0.05), seconds=2.0):
+    """Frame loop rate vs colors sent through AdaptiveSender on slow links"""
+    print('sender: {} FPS frame loop for {} s per link latency'.format(
+        Utils.FPS, seconds))
+    for latency in latencies:
+        fps, stats = asyncio.run(_run_sender(latency, seconds))
+        print('  write {:4.0f} ms: loop {:5.1f} FPS, sent {:4d}, dropped {:4d}, '
+              'adapted rate {:5.1f}/s'.format(latency * 1e3, fps, stats['sent'],
+                                              stats['dropped'], stats['rate']))
+
+
+def _legacy_color_packet(R, G, B):
+    """Reference copy of the pre-HLCodec writeColor packet building"""
+    lista = [86, R, G, B, (int(10 * 255 / 100) & 0xFF), 256-16, 256-86]
+    values = bytearray(lista)
+    Utils.printLog("Change Color called R:{} G:{} B:{} ".format(R, G, B))
+    return values
+
+
+def bench_codec(n_packets=200000):
+    """Color packet encode throughput, list + bytearray vs HLCodec"""
+    codec = HLProtocol.HLCodec()
+
+    def encoded(R, G, B):
+        values = codec.color(R, G, B)
+        Utils.printLog("Change Color called R:{} G:{} B:{} ", R, G, B)
+        return values
+
+    colors = [(i % 256, (i * 7) % 256, (i * 13) % 256) for i in range(1000)]
+    for color in colors:
+        assert bytes(encoded(*color)) == bytes(_legacy_color_packet(*color))
+        assert HLProtocol.decode(encoded(*color)) == ('color', color)
+
+    print('codec: {} color packets, DEBUG_LOGS={}'.format(n_packets, Utils.DEBUG_LOGS))
+    for name, fn in (('legacy', _legacy_color_packet), ('HLCodec', encoded)):
+        start = time.perf_counter()
+        for i in range(n_packets // len(colors)):
+            for color in colors:
+                fn(*color)
+        elapsed = time.perf_counter() - start
+        print('  {:<8} {:6.2f} Mpackets/s'.format(name, n_packets / elapsed / 1e6))
+
+
+async def _run_link(interval, packets, seconds):
+    client = BLEClass.QBleakClient(SimDevice())
+    link = SimulatedClient(connection_interval=interval,
+                           packets_per_interval=packets).attach(client)
+    await client.start()
+    sender = AdaptiveSender(client)
+    sender.start()
+    submitted = {}
+    frame = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        color = (frame % 256, frame // 256 % 256, 1)
+        submitted[color] = time.perf_counter()
+        sender.submit_color(*color)
+        frame += 1
+        await asyncio.sleep(1.0 / Utils.FPS)
+    await asyncio.sleep(0.2)
+    await sender.stop()
+    await client.stop()
+    delays = [r.time - submitted[r.command.args] for r in link.commands('color')]
+    return frame, np.array(delays), sender.stats()
+
+
+def bench_link(links=((0.0075, 4), (0.03, 1), (0.05, 1)), seconds=2.0):
+    """Submit-to-device latency through AdaptiveSender on simulated links"""
+    print('link: {} FPS frame loop for {} s per simulated link'.format(
+        Utils.FPS, seconds))
+    for interval, packets in links:
+        with private_device_cache():
+            frames, delays, stats = asyncio.run(_run_link(interval, packets, seconds))
+        p50, p99 = np.percentile(delays * 1e3, [50, 99])
+        print('  {:4.1f} ms interval x {} packets: {:4d} frames, {:4d} delivered, '
+              'latency p50 {:5.1f} ms p99 {:5.1f} ms'.format(
+                  interval * 1e3, packets, frames, len(delays), p50, p99))
+
+
+async def _footprint_loop(seconds):
+    """Runs microphone_update at Utils.FPS, returns (frames, CPU seconds)"""
+    client, Utils.client = Utils.client, FakeClient()
+    Utils.sender = AdaptiveSender()
+    Utils.sender.start()
+    frames = _random_frames(Utils.FPS, ExternalAudio.samples_per_frame)
+    clock = time.perf_counter
+    cpu = time.process_time()
+    start = clock()
+    n = 0
+    while clock() - start < seconds:
+        await ExternalAudio.microphone_update(frames[n % len(frames)])
+        n += 1
+        await asyncio.sleep(max(0.0, start + n / Utils.FPS - clock()))
+    cpu = time.process_time() - cpu
+    await Utils.sender.stop()
+    Utils.sender = None
+    Utils.client = client
+    return n, cpu
+
+
+def _footprint_child(mode, seconds):
+    """Sets up the GUI or the headless app, runs the frame loop, prints usage"""
+    import resource
+    if mode == 'gui':
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        import qasync
+        from PyQt5.QtWidgets import QApplication
+        import pyhl
+        Utils.app = QApplication([])
+        loop = qasync.QEventLoop(Utils.app)
+        asyncio.set_event_loop(loop)
+        window = pyhl.MainWindow()
+        window.show()
+        with loop:
+            frames, cpu = loop.run_until_complete(_footprint_loop(seconds))
+    else:
+        import pyhld  # noqa: F401, loads the modules of the headless app
+        frames, cpu = asyncio.run(_footprint_loop(seconds))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    print(json.dumps({
+        'frames': frames,
+        'loop_cpu': cpu,
+        'total_cpu': usage.ru_utime + usage.ru_stime,
+        'max_rss': usage.ru_maxrss * scale,
+    }))
+
+
+def bench_footprint(seconds=5.0):
+    """Peak RSS and CPU of the GUI vs the headless app running the visualization"""
+    try:
+        import resource
+    except ImportError:
+        print('footprint: needs the resource module, not available on {}'.format(
+            sys.platform))
+        return
+    print('footprint: {} FPS visualization for {} s per setup, fresh process each'.format(
+        Utils.FPS, seconds))
+    results = {}
+    for mode in ('gui', 'headless'):
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--footprint-child',
+             mode, str(seconds)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        lines = child.stdout.strip().splitlines()
+        if child.returncode != 0 or not lines:
+            error = (child.stderr.strip().splitlines() or ['exit code {}'.format(
+                child.returncode)])[-1]
+            print('  {:<8} failed: {}'.format(mode, error))
+            continue
+        result = results[mode] = json.loads(lines[-1])
+        print('  {:<8} peak RSS {:6.1f} MB, CPU {:5.2f} s total, '
+              '{:5.1f} % while running ({} frames)'.format(
+                  mode, result['max_rss'] / 2**20, result['total_cpu'],
+                  100 * result['loop_cpu'] / seconds, result['frames']))
+    if len(results) == 2:
+        gui, headless = results['gui'], results['headless']
+        print('  headless / gui: RSS {:.2f}, CPU {:.2f} total, {:.2f} while running'.format(
+            headless['max_rss'] / gui['max_rss'],
+            headless['total_cpu'] / gui['total_cpu'],
+            headless['loop_cpu'] / gui['loop_cpu']))
+
+
+def _legacy_melmat(num_mel_bands, freq_min, freq_max, num_fft_bands, sample_rate):
+    """Reference copy of the per-band loop melbank.compute_melmat replaced"""
+    center_mel, lower_mel, upper_mel = melbank.melfrequencies_mel_filterbank(
+        num_mel_bands, freq_min, freq_max, num_fft_bands)
+    centers = melbank.mel_to_hertz(center_mel)
+    lowers = melbank.mel_to_hertz(lower_mel)
+    uppers = melbank.mel_to_hertz(upper_mel)
+    freqs = np.linspace(0.0, sample_rate / 2.0, num_fft_bands)
+    melmat = np.zeros((num_mel_bands, num_fft_bands))
+    for i, (center, lower, upper) in enumerate(zip(centers, lowers, uppers)):
+        left_slope = (freqs >= lower) == (freqs <= center)
+        melmat[i, left_slope] = (freqs[left_slope] - lower) / (center - lower)
+        right_slope = (freqs >= center) == (freqs <= upper)
+        melmat[i, right_slope] = (upper - freqs[right_slope]) / (upper - center)
+    return melmat
+
+
+def bench_melbank(settings=((24, 60, 120, 735, 44100), (24, 60, 12000, 1470, 44100),
+                            (64, 20, 20000, 32769, 44100), (128, 20, 20000, 131073, 48000))):
+    """Mel filterbank construction: per-band loop vs vectorized vs cached"""
+    for bands in (1, 2, 12, 24, 48):
+        for fft_bands in (5, 735, 4097):
+            for low, high in ((60, 120), (20, 8000), (200, 22050)):
+                args = (bands, low, high, fft_bands, Utils.MIC_RATE)
+                assert np.array_equal(melbank.compute_melmat(*args)[0],
+                                      _legacy_melmat(*args))
+
+    print('melbank: build time in ms, bands / Hz range / FFT bins / rate')
+    for args in settings:
+        timings = []
+        for fn in (_legacy_melmat, melbank.compute_melmat):
+            start = time.perf_counter()
+            fn(*args)
+            timings.append(time.perf_counter() - start)
+        dsp.mel_bank.cache_clear()
+        dsp.mel_bank(*args)
+        start = time.perf_counter()
+        dsp.mel_bank(*args)
+        timings.append(time.perf_counter() - start)
+        print('  {:>4} {:>5}-{:<5} {:>6} {:>5}: loop {:8.2f}, vectorized {:7.2f}, '
+              'cached {:6.3f}'.format(*args, *(t * 1e3 for t in timings)))
+    dsp.mel_bank.cache_clear()
+
+
+def bench_kernels(n_frames=20000, sizes=(12, 24, 48)):
+    """GaussianSmoother vs scipy.ndimage.gaussian_filter1d, timed
+
+    That both agree is checked by test_dsp.py.
+    """
+    try:
+        from scipy.ndimage import gaussian_filter1d
+    except ImportError:
+        print('kernels: scipy is not installed, nothing to compare against')
+        return
+    rng = np.random.default_rng(0)
+    print('kernels: smoothed max of the mel energies, sigma=1, us/frame')
+    for size in sizes:
+        x = rng.random(size)
+        smoother = dsp.GaussianSmoother(size, sigma=1.0)
+        timings = []
+        for fn in (lambda: np.max(gaussian_filter1d(x, sigma=1.0)),
+                   lambda: smoother.smooth_max(x)):
+            start = time.perf_counter()
+            for _ in range(n_frames):
+                fn()
+            timings.append((time.perf_counter() - start) / n_frames)
+        print('  {:>3} bins: scipy {:6.2f}, GaussianSmoother {:6.2f}'.format(
+            size, *(t * 1e6 for t in timings)))
+
+
+def _beat_frames(seconds, bpm, seed=0):
+    """Low noise with a decaying 90 Hz kick every beat, as frames of audio
+
+    Returns (frames, index of the frame each kick starts in).
+    """
+    rate, frame_size = Utils.MIC_RATE, ExternalAudio.samples_per_frame
+    n_frames = int(seconds * Utils.FPS)
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 200, n_frames * frame_size)
+    kick_t = np.arange(int(0.15 * rate)) / rate
+    kick = 20000 * np.sin(2 * np.pi * 90 * kick_t) * np.exp(-kick_t / 0.04)
+    starts = np.arange(int(0.5 * rate), len(audio) - len(kick), int(60.0 / bpm * rate))
+    for start in starts:
+        audio[start:start + len(kick)] += kick
+    frames = audio.astype(np.float32).reshape(n_frames, frame_size)
+    return frames, starts // frame_size
+
+
+async def _run_onset(interval, packets, seconds, bpm):
+    ExternalAudio.reset()
+    frames, beats = _beat_frames(seconds, bpm)
+    client = BLEClass.QBleakClient(SimDevice())
+    SimulatedClient(connection_interval=interval,
+                    packets_per_interval=packets).attach(client)
+    await client.start()
+    previous, Utils.client = Utils.client, client
+    Utils.sender = AdaptiveSender()
+    Utils.sender.start()
+    detected = []
+    clock = time.perf_counter
+    start = clock()
+    for i, y in enumerate(frames):
+        # The frame is treated as recorded right now
+        await ExternalAudio.microphone_update(y, clock())
+        if ExternalAudio.onsets.onset:
+            detected.append(i)
+        await asyncio.sleep(max(0.0, start + (i + 1) / Utils.FPS - clock()))
+    await asyncio.sleep(0.2)
+    await Utils.sender.stop()
+    Utils.sender = None
+    Utils.client = previous
+    await client.stop()
+    return detected, beats, ExternalAudio.onsets.stats()
+
+
+def bench_onset(links=((0.0075, 4), (0.03, 1), (0.05, 1)), seconds=4.0, bpm=120):
+    """Onset detection hits and audio-to-light latency of the beat pulse"""
+    print('onset: {} BPM kicks for {} s at {} FPS, one frame = {:.1f} ms'.format(
+        bpm, seconds, Utils.FPS, 1e3 / Utils.FPS))
+    for interval, packets in links:
+        with private_device_cache():
+            detected, beats, stats = asyncio.run(_run_onset(interval, packets, seconds, bpm))
+        # A kick counts as found when an onset fires within two frames of it
+        hits = sum(any(0 <= d - b <= 2 for d in detected) for b in beats)
+        print('  {:4.1f} ms interval x {}: {:2d}/{:2d} kicks found, {:2d} false, '
+              'latency p50 {:5.1f} ms p95 {:5.1f} ms max {:5.1f} ms'.format(
+                  interval * 1e3, packets, hits, len(beats), len(detected) - hits,
+                  stats['latency_ms_p50'] or 0.0, stats['latency_ms_p95'] or 0.0,
+                  stats['latency_ms_max'] or 0.0))
+
+
+def bench_effects(n_frames=2000, pixels=(30, 60, 150, 300)):
+    """Time and allocations per frame of every ExternalAudio effect"""
+    rng = np.random.default_rng(0)
+    previous = None
+    print('effects: us/frame and B allocated/frame, writing into the (3, N_PIXELS) buffer')
+    print('  {:>6} | {}'.format('pixels', ' '.join(
+        '{:>19}'.format(name) for name in ExternalAudio.EFFECTS)))
+    try:
+        for n_pixels in pixels:
+            settings = configure(N_PIXELS=n_pixels)
+            previous = previous or settings
+            frames = [rng.random(Utils.N_FFT_BINS) for _ in range(n_frames)]
+            results = []
+            for name, effect in ExternalAudio.EFFECTS.items():
+                ExternalAudio.set_effect(name)
+                fn = lambda mel: effect(mel, ExternalAudio.pixels)
+                results.append((_time_per_call(fn, frames),
+                                _allocated_per_call(fn, frames[:200])))
+            print('  {:>6} | {}'.format(n_pixels, ' '.join(
+                '{:6.1f} us {:6.0f} B'.format(t * 1e6, a) for t, a in results)))
+    finally:
+        ExternalAudio.set_effect('spectrum')
+        if previous:
+            configure(**previous)
+
+
+def _legacy_led_color(pixels):
+    """Reference copy of led_color before it reduced ahead of the gamma lookup"""
+    pixels = np.clip(pixels, 0, 255).astype(int)
+    p = ExternalAudio._gamma[pixels]
+    r = p[0][:].astype(int)
+    g = p[1][:].astype(int)
+    b = p[2][:].astype(int)
+    return int(max(r)), int(max(g)), int(max(b))
+
+
+def bench_output(n_frames=2000, pixels=(30, 60, 150, 300, 600)):
+    """Gamma and reduction per frame, per-pixel legacy vs single color vs strip"""
+    rng = np.random.default_rng(0)
+    previous = None
+    print('output: us/frame of turning the pixel buffer into what the sink takes')
+    try:
+        for n_pixels in pixels:
+            settings = configure(N_PIXELS=n_pixels)
+            previous = previous or settings
+            frames = [(rng.random((3, n_pixels)) * 400 - 50).astype(np.float32)
+                      for _ in range(n_frames)]
+            # Whole channels below, at and above the clipping range
+            frames[:3] = [np.full((3, n_pixels), value, np.float32)
+                          for value in (-1.0, 255.0, 1e6)]
+            for pixel_frame in frames:
+                assert ExternalAudio.led_color(pixel_frame) == _legacy_led_color(pixel_frame)
+                legacy = ExternalAudio._gamma[np.clip(pixel_frame, 0, 255).astype(int)]
+                assert np.array_equal(ExternalAudio.led_pixels(pixel_frame), legacy.T)
+            timings = [_time_per_call(fn, frames) for fn in (
+                _legacy_led_color, ExternalAudio.led_color, ExternalAudio.led_pixels)]
+            print('  {:>4} pixels: legacy {:6.1f}, single color {:5.1f}, '
+                  'strip {:5.1f}'.format(n_pixels, *(t * 1e6 for t in timings)))
+    finally:
+        if previous:
+            configure(**previous)
+
+
+async def _run_udp(protocol, n_pixels, fps, seconds):
+    """Streams random strips at fps to a loopback receiver
+
+    Returns (send seconds per frame, bytes allocated per frame, frames
+    sent, sink stats, receiver, whether the last frame arrived intact).
+    """
+    receiver = await UDPStripReceiver.listen(n_pixels)
+    sink = UDPStripSink(*receiver.address, protocol=protocol)
+    await sink.start()
+    rng = np.random.default_rng(0)
+    strips = rng.integers(0, 256, (fps, n_pixels, 3), dtype=np.uint8)
+    # Allocations of writePixels itself, measured unpaced
+    for strip in strips[:10]:
+        await sink.writePixels(strip)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for strip in strips:
+        await sink.writePixels(strip)
+    allocated = (tracemalloc.get_traced_memory()[1] - base) / len(strips)
+    tracemalloc.stop()
+    await asyncio.sleep(0.05)
+    receiver.frames = 0
+
+    clock = time.perf_counter
+    send_times = []
+    frames = 0
+    start = clock()
+    while clock() - start < seconds:
+        t = clock()
+        await sink.writePixels(strips[frames % fps])
+        send_times.append(clock() - t)
+        frames += 1
+        await asyncio.sleep(max(0.0, start + frames / fps - clock()))
+    await asyncio.sleep(0.05)
+    intact = np.array_equal(receiver.pixels, strips[(frames - 1) % fps])
+    await sink.stop()
+    receiver.close()
+    return np.median(send_times), allocated, frames, sink.stats(), receiver, intact
+
+
+def bench_udp(pixels=(150, 300, 600, 1200), protocols=('drgb', 'dnrgb', 'ddp'),
+              fps=60, seconds=2.0):
+    """Per-pixel UDP output at fps through the loopback interface"""
+    print('udp: {} FPS for {} s per strip, send time p50 per frame'.format(fps, seconds))
+    for protocol, n_pixels in itertools.product(protocols, pixels):
+        if protocol == 'drgb' and n_pixels > DRGB_MAX_PIXELS:
+            continue
+        send, allocated, frames, stats, receiver, intact = asyncio.run(
+            _run_udp(protocol, n_pixels, fps, seconds))
+        print('  {:<5} {:>5} pixels: {} packets/frame, {:6.1f} us/frame, '
+              '{:5.0f} B allocated/frame, {:4d} sent {:4d} received {:3d} dropped, '
+              '{:5.2f} Mbit/s, last frame {}'.format(
+                  protocol, n_pixels, stats['packets_per_frame'], send * 1e6,
+                  allocated, frames, receiver.frames, stats['dropped'],
+                  8 * 3 * n_pixels * frames / seconds / 1e6,
+                  'intact' if intact else 'CORRUPT'))
+
+
+BENCHMARKS = {
+    'frame_engine': bench_frame_engine,
+    'filters': bench_filters,
+    'pipeline': bench_pipeline,
+    'sender': bench_sender,
+    'codec': bench_codec,
+    'link': bench_link,
+    'footprint': bench_footprint,
+    'melbank': bench_melbank,
+    'kernels': bench_kernels,
+    'onset': bench_onset,
+    'effects': bench_effects,
+    'output': bench_output,
+    'udp': bench_udp,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run, one of {} (default: all)'.format(
+                            ', '.join(BENCHMARKS)))
+    sweep = parser.add_argument_group('pipeline sweep')
+    sweep.add_argument('--pixels', type=int, nargs='+', help='N_PIXELS values')
+    sweep.add_argument('--bins', type=int, nargs='+', help='N_FFT_BINS values')
+    sweep.add_argument('--history', type=int, nargs='+',
+                       help='N_ROLLING_HISTORY values')
+    sweep.add_argument('--fps', type=int, nargs='+', help='FPS values')
+    parser.add_argument('--footprint-child', nargs=2, metavar=('MODE', 'SECONDS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.footprint_child:
+        mode, seconds = args.footprint_child
+        _footprint_child(mode, float(seconds))
+        return
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {!r}'.format(name))
+    options = {'pipeline': {key: getattr(args, key)
+                            for key in ('pixels', 'bins', 'history', 'fps')
+                            if getattr(args, key)}}
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](**options.get(name, {}))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 
 from __future__ import print_function
+import functools
+from collections import deque
 import numpy as np
 import Utils
 import melbank
+import StartupProfile
 
 
 class ExpFilter:
@@ -26,6 +29,341 @@ class ExpFilter:
         return self.value
 
 
+class ExpFilterBank:
+    """Exponential smoothing filters sharing stacked state arrays
+
+    Behaves like a collection of ExpFilter instances, but the state, input
+    and rise/decay factors of every filter live in one flat array each and
+    are updated in place with ``out=`` ufuncs. Each filter is exposed as a
+    named view: ``bank[name]`` is its smoothed value and
+    ``bank.inputs[name]`` is where the next input can be written. Filters
+    added one after another can be updated together in a single pass.
+    """
+    def __init__(self):
+        self._specs = []
+        self._slices = {}
+        self.values = {}
+        self.inputs = {}
+        self._state = np.zeros(0)
+
+    def add(self, name, val=0.0, alpha_decay=0.5, alpha_rise=0.5):
+        """Adds a filter with the same parameters as ExpFilter"""
+        assert 0.0 < alpha_decay < 1.0, 'Invalid decay smoothing factor'
+        assert 0.0 < alpha_rise < 1.0, 'Invalid rise smoothing factor'
+        assert name not in self._slices, 'Duplicate filter {}'.format(name)
+        self._specs.append((name, np.shape(val), alpha_decay, alpha_rise))
+        state = np.concatenate((self._state, np.ravel(val).astype(float)))
+        self._build(state)
+
+    def _build(self, state):
+        size = len(state)
+        self._state = state
+        self._input = np.zeros(size)
+        self._diff = np.zeros(size)
+        self._alpha = np.zeros(size)
+        self._mask = np.zeros(size, dtype=bool)
+        self._rise = np.zeros(size)
+        self._decay = np.zeros(size)
+        self._view_cache = {}
+        start = 0
+        for name, shape, alpha_decay, alpha_rise in self._specs:
+            s = slice(start, start + int(np.prod(shape)))
+            start = s.stop
+            self._slices[name] = (s.start, s.stop)
+            self._rise[s] = alpha_rise
+            self._decay[s] = alpha_decay
+            self.values[name] = self._state[s].reshape(shape)
+            self.inputs[name] = self._input[s].reshape(shape)
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def _views(self, start, stop):
+        key = (start, stop)
+        if key not in self._view_cache:
+            s = slice(start, stop)
+            self._view_cache[key] = (self._input[s], self._state[s],
+                                     self._diff[s], self._mask[s],
+                                     self._alpha[s], self._rise[s],
+                                     self._decay[s])
+        return self._view_cache[key]
+
+    def _step(self, start, stop):
+        x, value, diff, mask, alpha, rise, decay = self._views(start, stop)
+        np.subtract(x, value, out=diff)
+        np.greater(diff, 0.0, out=mask)
+        np.copyto(alpha, decay)
+        np.copyto(alpha, rise, where=mask)
+        np.multiply(diff, alpha, out=diff)
+        np.add(value, diff, out=value)
+
+    def update(self, name, value):
+        """Feeds a new input to one filter and returns its smoothed value"""
+        np.copyto(self.inputs[name], value)
+        self._step(*self._slices[name])
+        return self.values[name]
+
+    def update_many(self, names=None):
+        """Updates the given filters (default: all) from their inputs
+
+        Inputs must already be written to ``bank.inputs``. Filters that were
+        added next to each other are updated in the same pass.
+        """
+        if names is None:
+            self._step(0, len(self._state))
+            return
+        spans = sorted(self._slices[name] for name in names)
+        start, stop = spans[0]
+        for next_start, next_stop in spans[1:]:
+            if next_start != stop:
+                self._step(start, stop)
+                start = next_start
+            stop = next_stop
+        self._step(start, stop)
+
+
+# np.fft.rfft only accepts an output buffer from NumPy 2.0 onwards
+_RFFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+class FrameEngine:
+    """Rolling audio window and FFT magnitude on preallocated buffers
+
+    Incoming frames are written into a float32 ring buffer, so nothing is
+    shifted or concatenated per frame. The window is applied straight from
+    the ring into a work buffer and the FFT is zero padded through its
+    ``n=`` argument instead of an ``np.pad`` copy.
+    """
+    def __init__(self, frame_size, n_frames, window=np.hamming):
+        self.frame_size = frame_size
+        self.n_samples = frame_size * n_frames
+        self.n_fft = 2**int(np.ceil(np.log2(self.n_samples)))
+        self.n_bins = self.n_samples // 2
+        self.ring = (np.random.rand(self.n_samples) / 1e16).astype(np.float32)
+        self.window = window(self.n_samples).astype(np.float32)
+        self.work = np.zeros(self.n_samples, dtype=np.float32)
+        self.spectrum = np.zeros(self.n_bins)
+        self._fft_out = np.zeros(self.n_fft // 2 + 1, dtype=np.complex128)
+        self._head = 0
+
+    def history(self):
+        """Returns the rolling window, oldest sample first"""
+        head = self._head
+        return np.concatenate((self.ring[head:], self.ring[:head]))
+
+    def prime(self, samples):
+        """Fills the rolling window with the newest of the (already scaled)
+        samples, e.g. the ``history()`` of an engine being replaced"""
+        n = min(len(samples), self.n_samples)
+        if n:
+            self.ring[-n:] = samples[-n:]
+        self._head = 0
+
+    def push(self, y):
+        """Adds one frame of raw int16-scaled samples to the rolling window"""
+        head = self._head
+        np.multiply(y, 1.0 / 2.0**15, out=self.ring[head:head + self.frame_size])
+        self._head = (head + self.frame_size) % self.n_samples
+
+    def window_frame(self):
+        """Writes the windowed rolling window, oldest sample first, to work"""
+        head = self._head
+        tail = self.n_samples - head
+        np.multiply(self.ring[head:], self.window[:tail], out=self.work[:tail])
+        np.multiply(self.ring[:head], self.window[tail:], out=self.work[tail:])
+        return self.work
+
+    def fft(self):
+        """Zero padded FFT of the work buffer"""
+        if _RFFT_HAS_OUT:
+            return np.fft.rfft(self.work, n=self.n_fft, out=self._fft_out)
+        return np.fft.rfft(self.work, n=self.n_fft)
+
+    def update(self, y, bins=None):
+        """Pushes a frame and returns the magnitude spectrum of the window
+
+        Only the FFT bins selected by the ``bins`` slice are converted to
+        magnitudes when it is given.
+        """
+        self.push(y)
+        self.window_frame()
+        bins = slice(0, self.n_bins) if bins is None else bins
+        return np.abs(self.fft()[bins], out=self.spectrum[bins])
+
+    def update_batch(self, frames, bins=None):
+        """Pushes consecutive frames at once, one magnitude spectrum per frame
+
+        Matches calling ``update`` on each row of ``frames`` in turn (to
+        float32 precision) and leaves the rolling window in the same state,
+        but windows and transforms all of them in one vectorized call.
+        """
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1)
+        samples = np.concatenate((self.history()[self.frame_size:],
+                                  frames * np.float32(1.0 / 2.0**15)))
+        windows = np.lib.stride_tricks.sliding_window_view(
+            samples, self.n_samples)[::self.frame_size]
+        bins = slice(0, self.n_bins) if bins is None else bins
+        spectra = np.abs(np.fft.rfft(windows * self.window, n=self.n_fft)[:, bins])
+        self.ring[:] = samples[-self.n_samples:]
+        self._head = 0
+        return spectra
+
+
+def gaussian_kernel(sigma, truncate=4.0):
+    """Normalized Gaussian FIR kernel of radius ``int(truncate * sigma + 0.5)``,
+    the same weights scipy.ndimage.gaussian_filter1d uses"""
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    phi = np.exp(-0.5 / (float(sigma) * float(sigma)) * x ** 2)
+    return phi / phi.sum()
+
+
+class GaussianSmoother:
+    """Gaussian smoothing of fixed size arrays on preallocated buffers
+
+    Matches ``scipy.ndimage.gaussian_filter1d(x, sigma, truncate=truncate)``
+    (mode 'reflect', to floating point rounding) along the last axis of
+    inputs of ``shape``. The input is gathered into a padded buffer through
+    a precomputed reflection index and the kernel is applied to a sliding
+    window view of that buffer with one matmul.
+
+    Parameters
+    ----------
+    shape : int or tuple
+        Shape of the arrays to smooth, each row is smoothed separately
+
+    sigma : float
+        Standard deviation of the Gaussian in samples
+
+    truncate : float
+        Kernel radius in standard deviations
+    """
+    def __init__(self, shape, sigma=1.0, truncate=4.0):
+        shape = tuple(np.atleast_1d(shape))
+        self.size = shape[-1]
+        self.kernel = gaussian_kernel(sigma, truncate)
+        radius = len(self.kernel) // 2
+        # 'symmetric' padding repeats the edge sample (d c b a | a b c d),
+        # which is scipy's 'reflect', also for radius > size
+        self._index = np.pad(np.arange(self.size), radius, mode='symmetric')
+        self._padded = np.zeros(shape[:-1] + (len(self._index),))
+        self._windows = np.lib.stride_tricks.sliding_window_view(
+            self._padded, len(self.kernel), axis=-1)
+        self.out = np.zeros(shape)
+
+    def smooth(self, x, out=None):
+        """Returns the smoothed x, in out or in a buffer reused by the next call"""
+        np.take(x, self._index, axis=-1, out=self._padded)
+        return np.matmul(self._windows, self.kernel,
+                         out=self.out if out is None else out)
+
+    def smooth_max(self, x):
+        """Returns the maximum of the smoothed x"""
+        return self.smooth(x).max()
+
+
+class OnsetDetector:
+    """Spectral flux onset detection with an adaptive threshold
+
+    The flux of a frame is the summed increase of every band over the
+    previous frame. An onset is a flux above ``mean + sensitivity * std``
+    of the recent fluxes (and above ``min_flux``), at least ``refractory``
+    frames after the previous onset. The mean and deviation are kept as
+    running sums over a ring of the last ``window`` fluxes, so an update is
+    a handful of ufunc calls on preallocated buffers.
+
+    ``record_latency`` collects the measured delay from the audio of an
+    onset to its pulse reaching the LEDs, see ``stats``.
+
+    Parameters
+    ----------
+    n_bins : int
+        Number of bands of the spectra passed to ``update``
+
+    window : int
+        Number of past frames the threshold adapts to
+
+    sensitivity : float
+        Standard deviations above the mean flux an onset needs
+
+    min_flux : float
+        Flux an onset needs at least, keeps noise in silence from firing
+
+    refractory : int
+        Minimum number of frames between two onsets
+    """
+    def __init__(self, n_bins, window=30, sensitivity=2.0, min_flux=0.1,
+                 refractory=4):
+        self.window = window
+        self.sensitivity = sensitivity
+        self.min_flux = min_flux
+        self.refractory = refractory
+        self.flux = 0.0
+        self.threshold = 0.0
+        self.onset = False
+        self.onsets = 0
+        self.frames = 0
+        self.latencies = deque(maxlen=256)
+        self._prev = np.zeros(n_bins)
+        self._diff = np.zeros(n_bins)
+        self._history = np.zeros(window)
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._last_onset = -refractory
+
+    def update(self, spectrum):
+        """Feeds the next spectrum, returns whether it starts an onset"""
+        diff = self._diff
+        np.subtract(spectrum, self._prev, out=diff)
+        np.maximum(diff, 0.0, out=diff)
+        np.copyto(self._prev, spectrum)
+        flux = float(diff.sum())
+
+        n = min(self.frames, self.window)
+        onset = False
+        if n == self.window:
+            mean = self._sum / n
+            std = max(self._sum_sq / n - mean * mean, 0.0) ** 0.5
+            self.threshold = max(mean + self.sensitivity * std, self.min_flux)
+            onset = (flux > self.threshold
+                     and self.frames - self._last_onset >= self.refractory)
+        i = self.frames % self.window
+        old = self._history[i]
+        self._history[i] = flux
+        if i == self.window - 1:
+            # Once per lap, so rounding errors of the running sums cannot pile up
+            self._sum = float(self._history.sum())
+            self._sum_sq = float(np.dot(self._history, self._history))
+        else:
+            self._sum += flux - old
+            self._sum_sq += flux * flux - old * old
+        self.flux = flux
+        self.onset = onset
+        if onset:
+            self.onsets += 1
+            self._last_onset = self.frames
+        self.frames += 1
+        return onset
+
+    def record_latency(self, seconds):
+        """Records the delay from the audio of an onset to its LED pulse"""
+        self.latencies.append(seconds)
+
+    def stats(self):
+        """Returns the detector counters and audio-to-light latency as a dict"""
+        latency = np.array(self.latencies) * 1e3
+        p50, p95 = np.percentile(latency, [50, 95]) if len(latency) else (None, None)
+        return {
+            'frames': self.frames,
+            'onsets': self.onsets,
+            'flux': self.flux,
+            'threshold': self.threshold,
+            'latency_ms_p50': p50,
+            'latency_ms_p95': p95,
+            'latency_ms_max': latency.max() if len(latency) else None,
+        }
+
+
 def rfft(data, window=None):
     window = 1.0 if window is None else window(len(data))
     ys = np.abs(np.fft.rfft(data * window))
@@ -41,14 +379,81 @@ def fft(data, window=None):
 
 
 def create_mel_bank():
-    global samples, mel_y, mel_x
+    """(Re)builds the mel filterbank from the Utils settings"""
+    with StartupProfile.step('dsp.create_mel_bank()'):
+        _create_mel_bank()
+
+
+def _create_mel_bank():
+    global samples, mel_y, mel_x, mel_bins, mel_band
     samples = int(Utils.MIC_RATE * Utils.N_ROLLING_HISTORY / (2.0 * Utils.FPS))
-    mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=Utils.N_FFT_BINS,
-                                               freq_min=Utils.MIN_FREQUENCY,
-                                               freq_max=Utils.MAX_FREQUENCY,
-                                               num_fft_bands=samples,
-                                               sample_rate=Utils.MIC_RATE)
+    mel_y, mel_x, mel_bins, mel_band = mel_bank(Utils.N_FFT_BINS,
+                                                Utils.MIN_FREQUENCY,
+                                                Utils.MAX_FREQUENCY,
+                                                samples, Utils.MIC_RATE)
+
+
+@functools.lru_cache(maxsize=8)
+def mel_bank(num_mel_bands, freq_min, freq_max, num_fft_bands, sample_rate):
+    """Returns a mel filterbank and the band of FFT bins it weights
+
+    The result is kept in memory for the last few settings, so switching
+    back and forth between them does not rebuild it. The arrays are shared
+    by every caller and read only.
+
+    Returns
+    -------
+    mel_y : np.array
+        (num_mel_bands, num_fft_bands) transformation matrix
+    mel_x : np.array
+        Center frequencies of the FFT bins
+    mel_bins : slice
+        The FFT bins with a nonzero weight in any band
+    mel_band : np.array
+        Contiguous copy of ``mel_y[:, mel_bins]``
+    """
+    mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=num_mel_bands,
+                                               freq_min=freq_min,
+                                               freq_max=freq_max,
+                                               num_fft_bands=num_fft_bands,
+                                               sample_rate=sample_rate)
+    # Only the FFT bins between freq_min and freq_max carry any weight, keep
+    # just that band of the matrix for the per-frame projection
+    used = np.flatnonzero(mel_y.any(axis=0))
+    mel_bins = slice(int(used[0]), int(used[-1]) + 1) if len(used) else slice(0, 0)
+    mel_band = np.ascontiguousarray(mel_y[:, mel_bins])
+    for array in (mel_y, mel_x, mel_band):
+        array.setflags(write=False)
+    return mel_y, mel_x, mel_bins, mel_band
+
+
+def mel_project(ys, out=None):
+    """Projects an FFT magnitude spectrum onto the mel filterbank
+
+    Parameters
+    ----------
+    ys : np.array
+        Magnitude spectrum with ``samples`` bins, or only the ``mel_bins``
+        slice of it. A 2D array is treated as one spectrum per row.
+
+    out : np.array, optional
+        Preallocated output of length N_FFT_BINS (per row)
+
+    Returns
+    -------
+    mel : np.array
+        Mel filterbank energies, equal to ``mel_y.dot(ys)``
+    """
+    if mel_band is None:
+        create_mel_bank()
+    if ys.shape[-1] != mel_band.shape[1]:
+        ys = ys[..., mel_bins]
+    return np.matmul(ys, mel_band.T, out=out)
+
+
+# Mel filterbank, built by create_mel_bank() on first use
 samples = None
 mel_y = None
 mel_x = None
-create_mel_bank()
\ No newline at end of file
+mel_bins = None
+mel_band = None
@@ -30,7 +30,8 @@ Functions
 ---------
 """
 
-from numpy import abs, append, arange, insert, linspace, log10, round, zeros
+from numpy import (abs, append, arange, insert, linspace, log10, round,
+                   searchsorted, zeros)
 
 
 def hertz_to_mel(freq):
@@ -135,19 +136,33 @@ def compute_melmat(num_mel_bands=12, freq_min=64, freq_max=8000,
     upper_edges_hz = mel_to_hertz(upper_edges_mel)
     freqs = linspace(0.0, sample_rate / 2.0, num_fft_bands)
     melmat = zeros((num_mel_bands, num_fft_bands))
-
-    for imelband, (center, lower, upper) in enumerate(zip(
-            center_frequencies_hz, lower_edges_hz, upper_edges_hz)):
-
-        left_slope = (freqs >= lower) == (freqs <= center)
-        melmat[imelband, left_slope] = (
-            (freqs[left_slope] - lower) / (center - lower)
-        )
-
-        right_slope = (freqs >= center) == (freqs <= upper)
-        melmat[imelband, right_slope] = (
-            (upper - freqs[right_slope]) / (upper - center)
-        )
+    if not num_mel_bands:
+        return melmat, (center_frequencies_mel, freqs)
+
+    # Band i rises from edges[i] to edges[i + 1] and falls to edges[i + 2],
+    # so every fft band between edges[j] and edges[j + 1] lies on the rising
+    # slope of band j and the falling slope of band j - 1 (which wins where
+    # both apply). All weights are computed at once from that index.
+    edges = append(lower_edges_hz,
+                   (center_frequencies_hz[-1], upper_edges_hz[-1]))
+    first = searchsorted(freqs, edges[0], 'left')
+    last = searchsorted(freqs, edges[-1], 'left')
+    columns = arange(first, last)
+    f = freqs[first:last]
+    j = searchsorted(edges, f, 'right') - 1
+
+    rising = j < num_mel_bands
+    band = j[rising]
+    melmat[band, columns[rising]] = (
+        (f[rising] - lower_edges_hz[band])
+        / (center_frequencies_hz[band] - lower_edges_hz[band])
+    )
+
+    falling = j > 0
+    band = j[falling] - 1
+    melmat[band, columns[falling]] = (
+        (upper_edges_hz[band] - f[falling])
+        / (upper_edges_hz[band] - center_frequencies_hz[band])
+    )
 
     return melmat, (center_frequencies_mel, freqs)
-
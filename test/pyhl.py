@@ -1,3 +1,6 @@
+import StartupProfile
+
+StartupProfile.install()
 from bleak import BleakScanner, BleakClient
 import asyncio
 import sys
@@ -9,8 +12,9 @@ from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 import BLEClass
 import Utils
+from DeviceGroup import DeviceGroup
 import os
-from SerialListener import ArduinoSerialListener
+from SerialListener import SerialHub
 
 try:
     from ctypes import windll
@@ -18,14 +22,16 @@ except ImportError:
     print("ctypes not imported due to different OS (Non Windows)")
 
 
+class QtBleakClient(BLEClass.QBleakClient, QObject):
+    """QBleakClient with the Qt signals of the GUI"""
+    messageChanged = pyqtSignal(bytes)
+
+
 class MainWindow(QMainWindow):
     def closeEvent(self, event):
         # Clean up Arduino listener when closing
-        if hasattr(self, "serial_listener"):
-            self.serial_listener.stop_listening()
-            self.serial_listener.disconnect()
-            if hasattr(self, "arduino_task") and self.arduino_task:
-                self.arduino_task.cancel()
+        if hasattr(self, "serial_hub"):
+            self.serial_hub.stop()
 
         # Clean up BLE connection
         if Utils.client is not None:
@@ -52,6 +58,12 @@ class MainWindow(QMainWindow):
         self.device_address = QLineEdit(self)
         self.device_address.setGeometry(QRect(160, 40, 130, 22))
 
+        self.disconnect_button = QPushButton("Disconnect", self)
+        self.disconnect_button.setGeometry(QRect(300, 40, 90, 23))
+        self.disconnect_button.setToolTip("Disconnect all strips")
+        self.disconnect_button.clicked.connect(self.handle_disconnect)
+        self.disconnect_button.setEnabled(False)
+
         self.connection_status = QLabel("Disconnected", self)
         self.connection_status.setGeometry(QRect(90, 40, 71, 20))
         self.connection_status.setStyleSheet("QLabel {color: red; }")
@@ -102,9 +114,15 @@ class MainWindow(QMainWindow):
         self.arduino_status.setGeometry(QRect(20, 90, 340, 20))
         self.arduino_status.setStyleSheet("QLabel {color: red;}")
 
-        # Create serial listener and populate ports
-        self.serial_listener = ArduinoSerialListener()
+        # The serial hub reads the Arduino ports and refreshes the port list
+        # when an Arduino is plugged in or removed. Commands go to the BLE
+        # connection, or are only logged (test mode) while there is none.
+        self.arduino_port = None
+        self.serial_hub = SerialHub()
+        self.serial_hub.on_ports_changed = self.handle_ports_changed
         self.populate_arduino_ports()
+        self.hub_task = asyncio.ensure_future(self.serial_hub.run())
+        self.hub_task.add_done_callback(self.handle_arduino_task_result)
 
         # Initial state
         self.devices = []
@@ -129,15 +147,13 @@ class MainWindow(QMainWindow):
         self.scan_progress.show()
         self.movie.start()
 
-        # Perform scan
-        devices = await BLEClass.BleakScanner.discover(timeout=8.0)
-        self.devices = devices
-
-        # Populate dropdown
-        for i, device in enumerate(self.devices):
-            if str(device.name).startswith("QHM"):
-                print(f"Found Device {device.name}")
-                self.devices_combobox.insertItem(i, device.name, device)
+        # Stream devices into the dropdown as they are seen, the scan ends
+        # early once every previously known controller has shown up
+        known = BLEClass.known_devices()
+        async for device in BLEClass.scan_devices(expected=known, timeout=8.0):
+            print(f"Found Device {device.name}")
+            self.devices.append(device)
+            self.devices_combobox.addItem(device.name, device)
 
         # Hide animation when done
         self.movie.stop()
@@ -149,44 +165,35 @@ class MainWindow(QMainWindow):
         try:
             # Get device from address field or dropdown
             if self.device_address.text() != "":
-                device = await BLEClass.BleakScanner.find_device_by_address(
-                    self.device_address.text()
-                )
+                device = await BLEClass.find_device(self.device_address.text())
             else:
                 device = self.devices_combobox.currentData()
 
             # Connect if we have a valid device
             if isinstance(device, BLEClass.BLEDevice):
-                # Disconnect existing connection if any
-                if Utils.client is not None:
-                    await Utils.client.stop()
-                    Utils.client = None
+                # Strips are added to the group, existing connections stay up
+                if Utils.client is None:
+                    Utils.client = DeviceGroup()
+                if device.address in Utils.client:
+                    print(f"{device.name} is already connected")
+                    return
 
                 # Temporarily update UI to show connecting status
                 self.connection_status.setText("Connecting...")
                 self.connection_status.setStyleSheet("QLabel {color: orange;}")
                 QApplication.processEvents()  # Force UI update
 
-                # Create and start the new connection
-                Utils.client = BLEClass.QBleakClient(device)
-
                 # Start connection with proper service discovery
-                success = await Utils.client.start()
+                success = await Utils.client.add(device, QtBleakClient(device))
 
                 if success:
                     # Update UI on successful connection
-                    self.connection_status.setText("Connected")
-                    self.connection_status.setStyleSheet("QLabel {color: green;}")
-                    self.setControlsEnabled(True)
-                    self.connect_button.setText("Disconnect")
-                    self.connect_button.clicked.disconnect()
-                    self.connect_button.clicked.connect(self.handle_disconnect)
+                    self.update_connection_status()
                     print(f"Successfully connected to {device.name}")
                 else:
                     # Update UI on connection failure
                     self.connection_status.setText("Connection Failed")
                     self.connection_status.setStyleSheet("QLabel {color: red;}")
-                    Utils.client = None
                     print(f"Failed to connect to {device.name}")
             else:
                 print("No valid device selected")
@@ -194,25 +201,30 @@ class MainWindow(QMainWindow):
             self.connection_status.setText("Error")
             self.connection_status.setStyleSheet("QLabel {color: red;}")
             print(f"Connection error: {e}")
-            # Clean up in case of error
-            if Utils.client is not None:
-                await Utils.client.stop()
-                Utils.client = None
+
+    def update_connection_status(self):
+        """Show how many strips of the group are connected"""
+        connected = len(Utils.client) if Utils.client is not None else 0
+        if connected:
+            self.connection_status.setText(
+                "Connected" if connected == 1 else f"Connected ({connected})"
+            )
+            self.connection_status.setStyleSheet("QLabel {color: green;}")
+        else:
+            self.connection_status.setText("Disconnected")
+            self.connection_status.setStyleSheet("QLabel {color: red;}")
+        self.setControlsEnabled(connected > 0)
+        self.disconnect_button.setEnabled(connected > 0)
 
     @qasync.asyncSlot()
     async def handle_disconnect(self):
-        """Disconnect from the BLE device"""
+        """Disconnect from every BLE device of the group"""
         if Utils.client is not None:
             await Utils.client.stop()
             Utils.client = None
 
             # Update UI
-            self.connection_status.setText("Disconnected")
-            self.connection_status.setStyleSheet("QLabel {color: red;}")
-            self.setControlsEnabled(False)
-            self.connect_button.setText("Connect")
-            self.connect_button.clicked.disconnect()
-            self.connect_button.clicked.connect(self.handle_connect)
+            self.update_connection_status()
 
     @qasync.asyncSlot()
     async def handle_powerOn(self):
@@ -230,6 +242,7 @@ class MainWindow(QMainWindow):
 
     def populate_arduino_ports(self):
         """Get available serial ports and populate the combo box"""
+        selected = self.arduino_port_combo.currentData()
         self.arduino_port_combo.clear()
         import serial.tools.list_ports
 
@@ -239,18 +252,27 @@ class MainWindow(QMainWindow):
                 f"{port.device} - {port.description}", port.device
             )
 
-        # Select current port if exists
-        if hasattr(self.serial_listener, "port") and self.serial_listener.port:
+        # Keep the selection, else select the current port if exists
+        if self.arduino_port:
+            selected = self.arduino_port
+        if selected:
             for i in range(self.arduino_port_combo.count()):
-                if self.arduino_port_combo.itemData(i) == self.serial_listener.port:
+                if self.arduino_port_combo.itemData(i) == selected:
                     self.arduino_port_combo.setCurrentIndex(i)
                     break
 
+    def handle_ports_changed(self, added, removed):
+        """Called by the serial hub when serial ports appear or disappear"""
+        self.populate_arduino_ports()
+        if self.arduino_port in removed:
+            # The hub already closed the port
+            self.arduino_enabled.setChecked(False)
+
     def update_arduino_status(self, connected):
         """Update the Arduino connection status display"""
         if connected:
             self.arduino_status.setText(
-                f"Status: Connected ({self.serial_listener.port}) - Ready to receive on/off commands"
+                f"Status: Connected ({self.arduino_port}) - Ready to receive on/off commands"
             )
             self.arduino_status.setStyleSheet("QLabel {color: green;}")
         else:
@@ -262,48 +284,32 @@ class MainWindow(QMainWindow):
         """Toggle Arduino serial connection on/off"""
         if self.arduino_enabled.isChecked():
             # Get selected port
-            if self.arduino_port_combo.currentIndex() >= 0:
-                port = self.arduino_port_combo.itemData(
-                    self.arduino_port_combo.currentIndex()
-                )
-                self.serial_listener.port = port
-
-            # Try to connect
-            if self.serial_listener.connect():
-                self.update_arduino_status(True)
+            port = self.arduino_port_combo.currentData()
+            if not port:
+                print("No serial port selected")
+                self.arduino_enabled.setChecked(False)
+                return
 
-                # Start listening in test mode or with BLE client
+            # Try to connect, the hub starts reading right away
+            if await self.serial_hub.open(port):
+                self.arduino_port = port
+                self.update_arduino_status(True)
                 if self.current_client:
                     print("Starting Arduino listener with BLE connection")
-                    self.arduino_task = asyncio.create_task(
-                        self.serial_listener.start_listening(self.current_client)
-                    )
                 else:
                     print("Starting Arduino listener in test mode")
-                    self.arduino_task = asyncio.create_task(
-                        self.serial_listener.start_listening_test_mode()
-                    )
-
-                # Add error handler
-                self.arduino_task.add_done_callback(self.handle_arduino_task_result)
             else:
                 self.arduino_enabled.setChecked(False)
-                print(
-                    f"Failed to connect to Arduino on port {self.serial_listener.port}"
-                )
+                print(f"Failed to connect to Arduino on port {port}")
         else:
             # Stop listening and disconnect
-            self.serial_listener.stop_listening()
-            await asyncio.sleep(0.1)
-            self.serial_listener.disconnect()
+            if self.arduino_port:
+                self.serial_hub.close(self.arduino_port)
+                self.arduino_port = None
             self.update_arduino_status(False)
 
-            # Cancel task if it exists
-            if hasattr(self, "arduino_task") and self.arduino_task:
-                self.arduino_task.cancel()
-
     def handle_arduino_task_result(self, task):
-        """Handle the result of the Arduino listener task"""
+        """Handle the result of the serial hub task"""
         try:
             task.result()  # This will raise any exception that occurred
         except asyncio.CancelledError:
@@ -322,12 +328,16 @@ def main():
     except:
         pass
 
-    Utils.app = QApplication(sys.argv)
+    with StartupProfile.step('QApplication'):
+        Utils.app = QApplication(sys.argv)
     loop = qasync.QEventLoop(Utils.app)
     asyncio.set_event_loop(loop)
 
-    w = MainWindow()
-    w.show()
+    with StartupProfile.step('MainWindow'):
+        w = MainWindow()
+        w.show()
+    # Report once the window had its first event loop pass
+    loop.call_soon(StartupProfile.report)
 
     with loop:
         loop.run_forever()
@@ -6,7 +6,9 @@ a = Analysis(['pyhl.py'],
              pathex=['LEDStripController'],
              binaries=[],
              datas=[('Flower.gif', '.'), ('gamma_table.npy', '.')],
-             hiddenimports=[])
+             hiddenimports=[],
+             # Not used by the app, keeps the bundle and its unpacking small
+             excludes=['matplotlib', 'tkinter'])
 
 pyz = PYZ(a.pure, a.zipped_data,
              cipher=block_cipher)
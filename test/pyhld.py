@@ -0,0 +1,228 @@
+"""Headless PyHL: audio-reactive output and Arduino control without the GUI.
+
+Runs the BLE connection, the ExternalAudio visualization and the Arduino
+serial listener on a plain asyncio loop, for small boxes that have no
+display. Qt is never imported. Settings come from an INI file with a
+[pyhl] section and/or the command line (which wins), e.g.
+
+    [pyhl]
+    devices = 11:22:33:44:55:66
+    input_device = 2
+    serial_ports = /dev/ttyUSB0
+    serial_protocol = binary
+    n_pixels = 60
+    fps = 30
+    effect = scroll
+
+    python pyhld.py --config pyhl.ini
+    python pyhld.py --device 11:22:33:44:55:66 --no-audio --serial /dev/ttyUSB0
+    python pyhld.py --udp 192.168.1.50 --udp-protocol ddp --pixels 300
+
+With ``--udp`` the visualization goes pixel by pixel to an ESP8266/WLED
+strip instead of the BLE controllers, see UDPSink.
+
+``--startup-report`` prints the import and init times, see StartupProfile.
+"""
+import StartupProfile
+
+StartupProfile.install()
+
+import argparse
+import asyncio
+import configparser
+import signal
+import Utils
+import ExternalAudio
+import BLEClass
+from DeviceGroup import DeviceGroup
+from SerialListener import SerialHub
+from UDPSink import UDPStripSink, PROTOCOLS
+
+DEFAULTS = {
+    'devices': [],
+    'scan_timeout': 8.0,
+    'udp_host': '',
+    'udp_port': 0,
+    'udp_protocol': 'ddp',
+    'audio': True,
+    'input_device': -1,
+    'serial_ports': [],
+    'serial_auto': False,
+    'serial_protocol': 'text',
+    'serial_baudrate': None,
+    'n_pixels': Utils.N_PIXELS,
+    'fps': Utils.FPS,
+    'min_frequency': Utils.MIN_FREQUENCY,
+    'max_frequency': Utils.MAX_FREQUENCY,
+    'n_fft_bins': Utils.N_FFT_BINS,
+    'effect': Utils.Effect,
+    'debug': False,
+}
+
+# Settings of ExternalAudio.config, the Utils names are upper case
+UTILS_SETTINGS = ('n_pixels', 'fps', 'min_frequency', 'max_frequency', 'n_fft_bins')
+
+
+def read_config(path):
+    """Returns the settings of the [pyhl] section of an INI file"""
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise SystemExit('Cannot read config file {}'.format(path))
+    if not parser.has_section('pyhl'):
+        return {}
+    section = parser['pyhl']
+    settings = {}
+    for name, default in DEFAULTS.items():
+        if name not in section:
+            continue
+        if isinstance(default, bool):
+            settings[name] = section.getboolean(name)
+        elif isinstance(default, list):
+            settings[name] = section[name].replace(',', ' ').split()
+        elif isinstance(default, float):
+            settings[name] = section.getfloat(name)
+        elif isinstance(default, int) or name == 'serial_baudrate':
+            settings[name] = section.getint(name)
+        else:
+            settings[name] = section[name]
+    return settings
+
+
+def parse_args(argv=None):
+    """Returns the settings from DEFAULTS, the config file and the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', help='INI file with a [pyhl] section')
+    parser.add_argument('--device', dest='devices', action='append',
+                        help='BLE address of a controller, repeat for several '
+                             '(default: every controller found by a scan)')
+    parser.add_argument('--scan-timeout', type=float)
+    parser.add_argument('--udp', dest='udp_host',
+                        help='address of a UDP strip, used instead of the BLE controllers')
+    parser.add_argument('--udp-port', type=int, help='default: the one of the protocol')
+    parser.add_argument('--udp-protocol', choices=tuple(PROTOCOLS))
+    parser.add_argument('--no-audio', dest='audio', action='store_false', default=None,
+                        help='do not visualize the microphone input')
+    parser.add_argument('--input-device', type=int, help='PyAudio input device index')
+    parser.add_argument('--serial', dest='serial_ports', action='append',
+                        help='Arduino serial port, repeat for several')
+    parser.add_argument('--serial-auto', action='store_true', default=None,
+                        help='listen on every serial port that gets plugged in')
+    parser.add_argument('--serial-protocol', choices=('text', 'binary'))
+    parser.add_argument('--serial-baudrate', type=int)
+    parser.add_argument('--pixels', dest='n_pixels', type=int)
+    parser.add_argument('--fps', type=int)
+    parser.add_argument('--min-frequency', type=int)
+    parser.add_argument('--max-frequency', type=int)
+    parser.add_argument('--bins', dest='n_fft_bins', type=int)
+    parser.add_argument('--effect', choices=tuple(ExternalAudio.EFFECTS))
+    parser.add_argument('--debug', action='store_true', default=None)
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print import and init times once running')
+    args = parser.parse_args(argv)
+
+    settings = dict(DEFAULTS)
+    if args.config:
+        settings.update(read_config(args.config))
+    settings.update({name: value for name, value in vars(args).items()
+                     if name in DEFAULTS and value is not None})
+    return settings
+
+
+def configure(settings):
+    """Applies the audio settings to Utils and rebuilds the audio state
+
+    The pipeline settings are checked by ExternalAudio.config, invalid ones
+    end the program before anything is started.
+    """
+    Utils.DEBUG_LOGS = settings['debug']
+    Utils.selectedInputDevice = settings['input_device']
+    try:
+        ExternalAudio.config.update(**{name.upper(): settings[name]
+                                       for name in UTILS_SETTINGS})
+        ExternalAudio.set_effect(settings['effect'])
+    except ValueError as e:
+        raise SystemExit('Invalid settings: {}'.format(e))
+    if settings['audio']:
+        ExternalAudio.reset()
+
+
+async def find_devices(addresses, timeout):
+    """Returns the BLE devices to drive, looked up by address or scanned for"""
+    if addresses:
+        devices = await asyncio.gather(*(BLEClass.find_device(address, timeout)
+                                         for address in addresses))
+        for address, device in zip(addresses, devices):
+            if device is None:
+                print("Controller {} was not found".format(address))
+        return [device for device in devices if device is not None]
+    devices = []
+    async for device in BLEClass.scan_devices(expected=BLEClass.known_devices(),
+                                              timeout=timeout):
+        print("Found {} ({})".format(device.name, device.address))
+        devices.append(device)
+    return devices
+
+
+async def run(settings):
+    """Runs until SIGINT/SIGTERM"""
+    configure(settings)
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopped.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C raises KeyboardInterrupt instead
+            pass
+
+    if settings['udp_host']:
+        client = UDPStripSink(settings['udp_host'], settings['udp_port'],
+                              settings['udp_protocol'])
+        await client.start()
+        print("Sending {} to {}:{}".format(client.protocol, *client.address))
+    else:
+        client = DeviceGroup()
+        with StartupProfile.step('find devices'):
+            devices = await find_devices(settings['devices'], settings['scan_timeout'])
+        with StartupProfile.step('connect'):
+            connected = await client.connect(devices)
+        print("Connected to {} of {} controllers".format(sum(connected), len(devices)))
+    Utils.client = client
+
+    tasks = []
+    hub = None
+    if settings['serial_ports'] or settings['serial_auto']:
+        hub = SerialHub(settings['serial_baudrate'], settings['serial_protocol'],
+                        auto_open=settings['serial_auto'])
+        for port in settings['serial_ports']:
+            await hub.open(port)
+        tasks.append(asyncio.ensure_future(hub.run()))
+    if settings['audio']:
+        Utils.localAudio = True
+        tasks.append(asyncio.ensure_future(ExternalAudio.start_stream()))
+    loop.call_soon(StartupProfile.report)
+
+    try:
+        waiter = asyncio.ensure_future(stopped.wait())
+        await asyncio.wait(tasks + [waiter], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+    finally:
+        print("Stopping")
+        Utils.localAudio = False
+        if hub is not None:
+            hub.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await client.stop()
+        Utils.client = None
+
+
+def main(argv=None):
+    settings = parse_args(argv)
+    try:
+        asyncio.run(run(settings))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
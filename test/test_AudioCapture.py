@@ -0,0 +1,128 @@
+import asyncio
+import numpy as np
+import pytest
+
+pyaudio = pytest.importorskip('pyaudio')
+import Utils
+import ExternalAudio
+from AudioCapture import AudioCapture
+
+
+class FakeStream:
+    """PyAudio stream whose callback the test drives by hand"""
+    def __init__(self, stream_callback, **kwargs):
+        self.callback = stream_callback
+        self.active = False
+        self.closed = False
+
+    def get_input_latency(self):
+        return 0.0
+
+    def start_stream(self):
+        self.active = True
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.closed = True
+
+    def feed(self, samples):
+        self.callback(np.asarray(samples, dtype=np.int16).tobytes(),
+                      len(samples), None, 0)
+
+
+class FakeAudio:
+    def __init__(self):
+        self.streams = []
+        self.terminated = False
+
+    def open(self, **kwargs):
+        self.streams.append(FakeStream(**kwargs))
+        return self.streams[-1]
+
+    def terminate(self):
+        self.terminated = True
+
+
+@pytest.fixture
+def audio(monkeypatch):
+    fake = FakeAudio()
+    monkeypatch.setattr(Utils, 'p', fake, raising=False)
+    monkeypatch.setattr(Utils, 'localAudio', True)
+    monkeypatch.setattr(Utils, 'client', None)
+    return fake
+
+
+def test_stream_is_shut_down_when_a_frame_fails(audio, monkeypatch):
+    async def fail(y, frame_time=None):
+        raise RuntimeError('frame failed')
+
+    monkeypatch.setattr(ExternalAudio, 'microphone_update', fail)
+
+    async def run():
+        task = asyncio.ensure_future(ExternalAudio.start_stream())
+        await asyncio.sleep(0.01)
+        audio.streams[0].feed(np.zeros(ExternalAudio.samples_per_frame))
+        with pytest.raises(RuntimeError):
+            await task
+
+    asyncio.run(run())
+    assert audio.streams[0].closed and not audio.streams[0].active
+    assert audio.terminated
+    assert Utils.sender is None and ExternalAudio.capture is None
+
+
+def test_stream_is_shut_down_when_cancelled(audio):
+    async def run():
+        task = asyncio.ensure_future(ExternalAudio.start_stream())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert audio.streams[0].closed
+    assert Utils.sender is None and ExternalAudio.capture is None
+
+
+def _capture(audio, frame_size=735, chunk_size=256):
+    capture = AudioCapture(frame_size, rate=44100, chunk_size=chunk_size)
+    capture.start(audio)
+    return capture, audio.streams[-1]
+
+
+def test_frames_are_contiguous_while_keeping_up(audio):
+    samples = np.arange(20000) % 30000
+
+    async def run():
+        capture, stream = _capture(audio)
+        frames = []
+        for i in range(0, len(samples), 256):
+            stream.feed(samples[i:i + 256])
+            while capture._written - capture._read >= capture.frame_size:
+                frames.append((await capture.read()).copy())
+        return capture, frames
+
+    capture, frames = asyncio.run(run())
+    assert len(frames) == len(samples) // 735
+    assert np.array_equal(np.concatenate(frames), samples[:len(frames) * 735])
+    assert capture.dropped_frames == 0 and capture.skipped_samples == 0
+
+
+def test_lagging_reader_jumps_to_the_newest_frame(audio):
+    samples = np.arange(5000)
+
+    async def run():
+        capture, stream = _capture(audio, frame_size=1000, chunk_size=500)
+        stream.feed(samples[:1000])
+        first = (await capture.read()).copy()
+        stream.feed(samples[1000:])
+        newest = (await capture.read()).copy()
+        return capture, first, newest
+
+    capture, first, newest = asyncio.run(run())
+    assert np.array_equal(first, samples[:1000])
+    assert np.array_equal(newest, samples[4000:])
+    assert capture.skipped_samples == 3000 and capture.dropped_frames == 3
+
@@ -0,0 +1,86 @@
+import asyncio
+import time
+import pytest
+import BLEClass
+from BLESender import AdaptiveSender
+from BLESimulator import SimDevice, SimulatedClient, private_device_cache
+from DeviceGroup import DeviceGroup
+
+
+class FailingClient(SimulatedClient):
+    """Simulated link whose connect fails like an unreachable controller"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stopped = False
+
+    async def connect(self, **kwargs):
+        raise RuntimeError('Device was not found')
+
+    async def disconnect(self):
+        self.stopped = True
+        return await super().disconnect()
+
+
+@pytest.fixture(autouse=True)
+def device_cache():
+    with private_device_cache():
+        yield
+
+
+def test_connect_skips_unreachable_device():
+    async def run():
+        group = DeviceGroup()
+        devices = [SimDevice('00:00:00:00:00:01'), SimDevice('00:00:00:00:00:02')]
+        clients = [BLEClass.QBleakClient(device) for device in devices]
+        failing = FailingClient(devices[0]).attach(clients[0])
+        working = SimulatedClient(devices[1]).attach(clients[1])
+        connected = await asyncio.gather(*(group.add(device, client) for device, client
+                                           in zip(devices, clients)))
+        members = list(group.members)
+        await group.writeColor(1, 2, 3)
+        await asyncio.sleep(0.05)
+        await group.stop()
+        return connected, members, failing, working
+
+    connected, members, failing, working = asyncio.run(run())
+    assert connected == [False, True]
+    assert members == ['00:00:00:00:00:02']
+    assert failing.stopped
+    assert [r.command for r in working.received] == [('color', (1, 2, 3))]
+
+
+def test_pulses_do_not_slow_down_the_fast_strip():
+    async def run():
+        group = DeviceGroup()
+        devices = [SimDevice('00:00:00:00:00:01'), SimDevice('00:00:00:00:00:02')]
+        clients = [BLEClass.QBleakClient(device) for device in devices]
+        fast = SimulatedClient(devices[0], connection_interval=0.0075).attach(clients[0])
+        slow = SimulatedClient(devices[1], connection_interval=0.1,
+                               packets_per_interval=1).attach(clients[1])
+        for device, client in zip(devices, clients):
+            await group.add(device, client)
+        sender = AdaptiveSender(group, max_rate=60)
+        sender.start()
+        sent = []
+        clock = time.perf_counter
+        start = clock()
+        for frame in range(60):
+            if frame % 3:
+                sender.submit_color(frame, 0, 0)
+            else:
+                sender.submit_pulse(255, 255, 255, on_sent=sent.append)
+            await asyncio.sleep(max(0.0, start + (frame + 1) / 60 - clock()))
+        stats = sender.stats()
+        await asyncio.sleep(0.3)
+        await sender.stop()
+        await group.stop()
+        return fast, slow, stats, sent
+
+    fast, slow, stats, sent = asyncio.run(run())
+    # The outer sender only fans out, it never takes on the pace of a strip
+    assert stats['latency_ms'] is None or stats['latency_ms'] < 5
+    assert stats['pulses'] == 20
+    assert len(fast.received) >= 50
+    assert len(slow.received) < len(fast.received) // 2
+    # Every device reports its own pulse
+    assert 20 < len(sent) <= 40
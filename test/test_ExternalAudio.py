@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pyaudio')
+import Utils
+import ExternalAudio
+from AudioCapture import AudioCapture
+
+
+@pytest.fixture
+def settings():
+    previous = ExternalAudio.config.as_dict()
+    yield ExternalAudio.config
+    ExternalAudio.config.update(**previous)
+    ExternalAudio.set_effect('spectrum')
+
+
+@pytest.mark.parametrize('bins', (0, 1, 2))
+def test_too_few_bins_are_rejected(settings, bins):
+    with pytest.raises(ValueError):
+        settings.update(N_FFT_BINS=bins)
+
+
+@pytest.mark.parametrize('effect', sorted(ExternalAudio.EFFECTS))
+@pytest.mark.parametrize('n_pixels', (59, 60))
+def test_effects_write_every_pixel(settings, effect, n_pixels):
+    settings.update(N_PIXELS=n_pixels)
+    ExternalAudio.reset()
+    ExternalAudio.set_effect(effect)
+    ExternalAudio.pixels.fill(np.nan)
+    rng = np.random.default_rng(0)
+    pixels = ExternalAudio.process_frame(
+        rng.integers(-3000, 3000, ExternalAudio.samples_per_frame).astype(np.float32))
+    assert np.all(np.isfinite(pixels))
+    assert np.array_equal(pixels, pixels[:, ::-1])
+
+
+def test_single_pixel_is_rejected(settings):
+    with pytest.raises(ValueError):
+        settings.update(N_PIXELS=1)
+
+
+@pytest.fixture
+def capture(settings, monkeypatch):
+    ExternalAudio.reset()
+    capture = AudioCapture(ExternalAudio.samples_per_frame)
+    monkeypatch.setattr(ExternalAudio, 'capture', capture)
+    return capture
+
+
+def test_frames_too_long_for_the_capture_are_rejected(settings, capture):
+    fps, frame_size = Utils.FPS, ExternalAudio.samples_per_frame
+    with pytest.raises(ValueError):
+        settings.update(FPS=1)
+    assert Utils.FPS == fps
+    assert ExternalAudio.samples_per_frame == capture.frame_size == frame_size
+    assert ExternalAudio.engine.frame_size == frame_size
+
+
+def test_failed_rebuild_restores_the_settings(settings, capture, monkeypatch):
+    def fail(frame_size):
+        if frame_size != capture.frame_size:
+            raise RuntimeError('resize failed')
+
+    fps, frame_size = Utils.FPS, ExternalAudio.samples_per_frame
+    monkeypatch.setattr(capture, 'resize', fail)
+    with pytest.raises(RuntimeError):
+        settings.update(FPS=fps // 2)
+    assert Utils.FPS == fps
+    assert ExternalAudio.engine.frame_size == frame_size
+    assert ExternalAudio.dsp.samples == ExternalAudio.engine.n_samples // 2
+
+
+@pytest.mark.parametrize('effect', sorted(ExternalAudio.EFFECTS))
+def test_effects_render_with_fewest_bins(settings, effect):
+    settings.update(N_FFT_BINS=3)
+    ExternalAudio.reset()
+    ExternalAudio.set_effect(effect)
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        pixels = ExternalAudio.process_frame(
+            rng.integers(-3000, 3000, ExternalAudio.samples_per_frame).astype(np.float32))
+    assert pixels.shape == (3, Utils.N_PIXELS)
+    assert np.all(np.isfinite(pixels))
@@ -0,0 +1,78 @@
+import pytest
+import SerialProtocol
+from SerialProtocol import Frame, FrameParser, LineParser, encode
+
+FRAMES = [
+    Frame(SerialProtocol.POWER, b'\x01'),
+    Frame(SerialProtocol.COLOR, bytes((255, 0, SerialProtocol.SYNC))),
+    Frame(SerialProtocol.MODE, b'\x05'),
+    Frame(SerialProtocol.SPEED, b'\x00'),
+    Frame(SerialProtocol.ACK, bytes((SerialProtocol.COLOR,))),
+    Frame(0x10, b''),
+    Frame(0x11, bytes(range(SerialProtocol.MAX_PAYLOAD))),
+]
+
+
+def _stream(frames):
+    return b''.join(encode(*frame) for frame in frames)
+
+
+def test_encode_layout():
+    assert encode(SerialProtocol.COLOR, b'\x01\x02\x03') == bytes(
+        (0xA5, 3, 0x02, 1, 2, 3, 3 ^ 0x02 ^ 1 ^ 2 ^ 3))
+
+
+def test_round_trip_in_one_read():
+    parser = FrameParser()
+    assert parser.feed(_stream(FRAMES)) == FRAMES
+    assert parser.errors == 0
+    assert not parser.buffer
+
+
+@pytest.mark.parametrize('chunk', (1, 2, 3, 7))
+def test_frames_split_across_reads(chunk):
+    parser = FrameParser()
+    data = _stream(FRAMES)
+    received = []
+    for i in range(0, len(data), chunk):
+        received += parser.feed(data[i:i + chunk])
+    assert received == FRAMES
+    assert parser.errors == 0
+
+
+def test_resync_after_garbage():
+    parser = FrameParser()
+    garbage = b'\x00\x13hello\xff'
+    assert parser.feed(garbage + _stream(FRAMES[:2])) == FRAMES[:2]
+    assert parser.errors == 0
+
+
+def test_bad_checksum_is_skipped():
+    bad = bytearray(encode(SerialProtocol.COLOR, b'\x01\x02\x03'))
+    bad[-1] ^= 0xFF
+    parser = FrameParser()
+    assert parser.feed(bytes(bad) + _stream(FRAMES[:1])) == FRAMES[:1]
+    assert parser.errors == 1
+
+
+def test_length_over_max_payload_is_skipped():
+    oversized = bytes((SerialProtocol.SYNC, SerialProtocol.MAX_PAYLOAD + 1,
+                       SerialProtocol.COLOR))
+    parser = FrameParser()
+    assert parser.feed(oversized + _stream(FRAMES[:1])) == FRAMES[:1]
+    assert parser.errors == 1
+
+
+def test_incomplete_frame_waits_for_more():
+    data = encode(SerialProtocol.POWER, b'\x00')
+    parser = FrameParser()
+    assert parser.feed(data[:-1]) == []
+    assert parser.feed(data[-1:]) == [Frame(SerialProtocol.POWER, b'\x00')]
+
+
+def test_lines_are_stripped_and_split_across_reads():
+    parser = LineParser()
+    assert parser.feed(b'ON\r\n\n  POWER:OF') == ['ON']
+    assert parser.feed(b'F\nLED:') == ['POWER:OFF']
+    assert parser.feed(b'ON\n') == ['LED:ON']
+    assert parser.feed(b'\xff\n') == ['�']
@@ -0,0 +1,59 @@
+import asyncio
+import numpy as np
+import pytest
+from UDPSink import UDPStripSink, UDPStripReceiver, PROTOCOLS, DRGB_MAX_PIXELS
+
+
+def _strips(n_pixels, count=3):
+    rng = np.random.default_rng(n_pixels)
+    return rng.integers(0, 256, (count, n_pixels, 3), dtype=np.uint8)
+
+
+async def _stream(protocol, n_pixels, strips, sendmsg=True, before=None):
+    receiver = await UDPStripReceiver.listen(n_pixels)
+    sink = UDPStripSink(*receiver.address, protocol=protocol)
+    sink._sendmsg = sink._sendmsg and sendmsg
+    await sink.start()
+    if before is not None:
+        await before(sink)
+    for strip in strips:
+        await sink.writePixels(strip)
+    await asyncio.sleep(0.05)
+    await sink.stop()
+    receiver.close()
+    return sink, receiver
+
+
+@pytest.mark.parametrize('sendmsg', (True, False))
+@pytest.mark.parametrize('protocol, n_pixels', [
+    ('drgb', 60), ('drgb', DRGB_MAX_PIXELS), ('dnrgb', 60), ('dnrgb', 1200),
+    ('ddp', 60), ('ddp', 480), ('ddp', 1201)])
+def test_loopback_receives_last_frame(protocol, n_pixels, sendmsg):
+    strips = _strips(n_pixels)
+    sink, receiver = asyncio.run(_stream(protocol, n_pixels, strips, sendmsg))
+    assert receiver.errors == 0
+    assert receiver.frames == len(strips)
+    assert receiver.packets == sink.packets
+    assert np.array_equal(receiver.pixels, strips[-1])
+
+
+def test_ddp_splits_at_1440_bytes():
+    sink, receiver = asyncio.run(_stream('ddp', 1201, _strips(1201, 1)))
+    # 480 + 480 + 241 pixels
+    assert sink.stats()['packets_per_frame'] == 3
+
+
+def test_drgb_rejects_long_strips():
+    with pytest.raises(ValueError):
+        asyncio.run(_stream('drgb', DRGB_MAX_PIXELS + 1, _strips(DRGB_MAX_PIXELS + 1, 1)))
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+def test_power_off_sticks(protocol):
+    async def power_off(sink):
+        await sink.writePower("Off")
+
+    strips = _strips(60)
+    sink, receiver = asyncio.run(_stream(protocol, 60, strips, before=power_off))
+    assert receiver.frames == len(strips) + 1
+    assert not receiver.pixels.any()
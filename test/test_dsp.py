@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import dsp
+
+scipy_ndimage = pytest.importorskip('scipy.ndimage')
+
+
+@pytest.mark.parametrize('sigma', (0.2, 0.5, 1.0, 2.5, 4.0))
+@pytest.mark.parametrize('size', list(range(1, 12)) + [24, 30, 48])
+def test_smoother_matches_scipy(size, sigma):
+    rng = np.random.default_rng(size)
+    smoother = dsp.GaussianSmoother(size, sigma)
+    for scale in (1e-6, 1.0, 1e6):
+        x = rng.random(size) ** 2 * scale
+        expected = scipy_ndimage.gaussian_filter1d(x, sigma)
+        np.testing.assert_allclose(smoother.smooth(x), expected, rtol=1e-12, atol=0)
+        assert smoother.smooth_max(x) == np.max(smoother.out)
+
+
+@pytest.mark.parametrize('sigma', (0.2, 4.0))
+def test_smoother_rows_match_scipy(sigma):
+    x = np.random.default_rng(0).random((3, 30)) * 255
+    smoother = dsp.GaussianSmoother(x.shape, sigma)
+    out = np.empty_like(x)
+    result = smoother.smooth(x, out=out)
+    assert result is out
+    np.testing.assert_allclose(out, scipy_ndimage.gaussian_filter1d(x, sigma, axis=-1),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_kernel_matches_scipy_weights():
+    for sigma in (0.5, 1.0, 4.0):
+        impulse = np.zeros(41)
+        impulse[20] = 1.0
+        kernel = dsp.gaussian_kernel(sigma)
+        radius = len(kernel) // 2
+        expected = scipy_ndimage.gaussian_filter1d(impulse, sigma)[20 - radius:21 + radius]
+        np.testing.assert_allclose(kernel, expected, rtol=1e-12)